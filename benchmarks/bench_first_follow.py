@@ -0,0 +1,67 @@
+"""
+Scaling of the FIRST/FOLLOW/nullable computation with the number of tag non-terminals.
+
+Builds synthetic grammars shaped like the ones produced by ProductionRuleProcessor for a closed
+set of IRIs (one `_TAG_NT` chain per prefix group) and times the LL(1) set computation.
+With the worklist implementation the time per non-terminal stays roughly constant.
+
+    python -m benchmarks.bench_first_follow --tags 1000 2000 4000 8000 16000 32000
+"""
+import argparse
+import gc
+import time
+
+from grammarllm.scripts.generate_LL1_parsing_table import compute_nullable, compute_first_sets, follow
+
+
+def tag_grammar(n_tags, depth=4):
+    """Grammar S* -> < URI > S* | ε with `n_tags` prefix groups, each a chain of `depth` tag non-terminals."""
+    productions = {
+        'S*': [['<', 'URI', '>', 'S*'], ['ε']],
+        'URI': [],
+    }
+    for i in range(n_tags):
+        nt = f"URI_TAG_NT{i}"
+        productions['URI'].append([f"p{i}", nt])
+        for level in range(1, depth + 1):
+            child = f"{nt}_{level}"
+            # Un tag termina qui, gli altri proseguono nel sotto-gruppo
+            productions[nt] = [[f"t{i}_{level}", child], [f"u{i}_{level}"], []]
+            nt = child
+        productions[nt] = [[f"leaf{i}"]]
+    return productions
+
+
+def run(n_tags, depth, repeat):
+    productions = tag_grammar(n_tags, depth)
+    best = float('inf')
+    for _ in range(repeat):
+        # Come timeit: il garbage collector è disattivato durante la misura
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            nullable = compute_nullable(productions)
+            first_sets = compute_first_sets(productions, nullable)
+            follow(productions, first_sets, 'S*')
+            best = min(best, time.perf_counter() - start)
+        finally:
+            gc.enable()
+    return len(productions), best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tags', type=int, nargs='+', default=[1000, 2000, 4000, 8000, 16000, 32000])
+    parser.add_argument('--depth', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'tags':>8} {'non-terminals':>14} {'seconds':>10} {'us / NT':>10}")
+    for n_tags in args.tags:
+        n_nt, seconds = run(n_tags, args.depth, args.repeat)
+        print(f"{n_tags:>8} {n_nt:>14} {seconds:>10.4f} {seconds / n_nt * 1e6:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
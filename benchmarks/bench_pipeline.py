@@ -0,0 +1,92 @@
+"""
+Per-token latency of the single-prompt decode loop, sequential vs pipelined.
+
+In the pipelined loop the sampled token goes straight back into the model while the PDA
+transition and the mask of the next step are computed on a worker thread, so the parser work
+overlaps the forward pass instead of adding to it. Outputs of the two loops must be identical.
+The gain grows with the parser work per step and needs the host to be idle during the forward,
+as with an accelerator. On a CPU-only box the worker competes with the forward for the cores
+(and the GIL), so `--device-latency-ms` can emulate the time an accelerator spends executing the
+forward while the host is free (the main thread sleeps, releasing the GIL, after each forward).
+
+    python -m benchmarks.bench_pipeline --grammar rdf --tokens 128 --repeat 5
+    python -m benchmarks.bench_pipeline --device-latency-ms 5
+"""
+import argparse
+import functools
+import statistics
+import time
+
+import torch
+
+from grammarllm import generate_grammar_parameters, get_parsing_table_and_map_tt
+from grammarllm.generate_with_constraints import _decode_loop, _pipelined_decode_loop
+
+from .synthetic import GRAMMARS, build_model, build_tokenizer
+
+
+def time_loop(loop, model, tokenizer, grammar, prompt, max_new_tokens, repeat, **options):
+    """Best and median ms per generated token over `repeat` runs, and the generated ids."""
+    pars_tab, map_terminal_tokens = grammar
+    encoded = tokenizer(prompt, return_tensors="pt")
+    timings = []
+    for _ in range(repeat):
+        logit_processor, streamer = generate_grammar_parameters(tokenizer, pars_tab, map_terminal_tokens)
+        start = time.perf_counter()
+        output = loop(model, tokenizer, encoded["input_ids"], encoded["attention_mask"], logit_processor, streamer,
+                      max_new_tokens, False, None, None, **options)
+        elapsed = time.perf_counter() - start
+        generated = output.shape[-1] - encoded["input_ids"].shape[-1]
+        timings.append(elapsed / max(generated, 1) * 1000)
+    return min(timings), statistics.median(timings), output[0].tolist()
+
+
+def emulate_device_latency(model, milliseconds):
+    """Make every forward of `model` also wait `milliseconds` without holding the GIL, like an async device."""
+    forward = model.forward
+
+    @functools.wraps(forward)
+    def delayed_forward(*args, **kwargs):
+        outputs = forward(*args, **kwargs)
+        time.sleep(milliseconds / 1000)
+        return outputs
+
+    model.forward = delayed_forward
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--grammar", choices=sorted(GRAMMARS), default="rdf")
+    parser.add_argument("--vocab-size", type=int, default=32000)
+    parser.add_argument("--hidden-size", type=int, default=256)
+    parser.add_argument("--layers", type=int, default=4)
+    parser.add_argument("--tokens", type=int, default=128)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--jump-forward", action="store_true")
+    parser.add_argument("--device-latency-ms", type=float, default=0.0,
+                        help="emulated accelerator time per forward, during which the host is idle")
+    args = parser.parse_args()
+
+    tokenizer = build_tokenizer(args.vocab_size)
+    model = build_model(tokenizer, hidden_size=args.hidden_size, num_layers=args.layers)
+    if args.device_latency_ms:
+        emulate_device_latency(model, args.device_latency_ms)
+    productions, regex_dict = GRAMMARS[args.grammar]
+    grammar = get_parsing_table_and_map_tt(tokenizer, productions, regex_dict=regex_dict)
+    prompt = "Generate RDF triples about people:"
+
+    print(f"grammar={args.grammar} vocab={len(tokenizer)} torch threads={torch.get_num_threads()} "
+          f"emulated device ms/forward={args.device_latency_ms}")
+    print(f"{'loop':>12} {'best ms/tok':>12} {'median ms/tok':>14}")
+    outputs = {}
+    for name, loop in (("sequential", _decode_loop), ("pipelined", _pipelined_decode_loop)):
+        best, median, outputs[name] = time_loop(loop, model, tokenizer, grammar, prompt, args.tokens, args.repeat,
+                                                jump_forward=args.jump_forward)
+        print(f"{name:>12} {best:>12.3f} {median:>14.3f}")
+
+    if outputs["sequential"] != outputs["pipelined"]:
+        raise SystemExit("The pipelined loop generated a different output")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+"""
+End-to-end load test of generate_text with a tiny local model: throughput, latency percentiles and
+split of the time between the model and the grammar.
+
+The tokenizer and the randomly initialised Llama of synthetic.py are built locally, so nothing is
+downloaded. Every grammar of the mix is compiled once (compile_grammar) and shared by all the
+requests; each request opens its own session. `--concurrency` workers send requests back to back
+(closed loop) until `--requests` have been served; a request is a batch of `--batch-size` prompts
+whose grammars are drawn from the weighted `--mix`. After `--warmup` untimed requests it reports:
+
+* throughput: requests/s and generated tokens/s over the wall-clock time of the run;
+* latency of a request (p50, p90, p99, max) and per generated token;
+* model vs grammar time, from the DecodingStats of the requests (return_stats=True), in total
+  and per grammar.
+
+Outputs of a random model are meaningless but always valid for the grammar. With several workers
+the forward passes compete for the cores: set `--torch-threads` to control the intra-op threads.
+
+    python -m benchmarks.load_test --concurrency 4 --requests 64
+    python -m benchmarks.load_test --mix classification=3 rdf=1 --batch-size 4 --max-new-tokens 48
+    python -m benchmarks.load_test --vocab-size 128000 --hidden-size 512 --layers 8 --output load.json
+"""
+import argparse
+import copy
+import json
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+from grammarllm import DecodingStats, compile_grammar, generate_batch_grammar_parameters, generate_text
+
+from .synthetic import FAMILIES, GRAMMARS, build_model, build_tokenizer
+
+# Grammatiche utilizzabili nel mix: quelle di esempio e le famiglie della suite
+GRAMMAR_FACTORIES = {**{name: (lambda grammar=grammar: grammar) for name, grammar in GRAMMARS.items()}, **FAMILIES}
+
+PROMPTS = {
+    'classification': ["How does the customer feel? I'm so happy today!", "Classify: the delivery was late again.",
+                       "Sentiment of: it was fine, nothing special."],
+    'vocabulary': ["Answer using the allowed words: how are you?", "Reply politely:"],
+    'rdf': ["Generate RDF triples about people:", "Describe Mario Rossi in RDF:"],
+    'regex_heavy': ["Write key=value records:", "Measurements:"],
+}
+
+
+def parse_mix(items):
+    """['classification=3', 'rdf'] -> {'classification': 3.0, 'rdf': 1.0}"""
+    mix = {}
+    for item in items:
+        name, _, weight = item.partition('=')
+        if name not in GRAMMAR_FACTORIES:
+            raise SystemExit(f"Unknown grammar {name!r}: choose among {', '.join(sorted(GRAMMAR_FACTORIES))}")
+        mix[name] = float(weight) if weight else 1.0
+    return mix
+
+
+def plan_requests(mix, n_requests, batch_size, seed):
+    """Grammar and prompt of every row of every request, drawn from the weighted mix."""
+    rng = random.Random(seed)
+    names, weights = list(mix), list(mix.values())
+    plan = []
+    for _ in range(n_requests):
+        rows = rng.choices(names, weights, k=batch_size)
+        plan.append([(name, rng.choice(PROMPTS.get(name, [f"Generate {name}:"]))) for name in rows])
+    return plan
+
+
+def percentile(values, q):
+    """Percentile `q` (0-100) with linear interpolation, as numpy's default."""
+    values = sorted(values)
+    position = (len(values) - 1) * q / 100
+    low = int(position)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (position - low)
+
+
+class LoadTest:
+    """Shared model and compiled grammars; every worker thread has its own tokenizer copy."""
+
+    def __init__(self, model, tokenizer, grammars, max_new_tokens, do_sample):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.grammars = grammars
+        self.max_new_tokens = max_new_tokens
+        self.do_sample = do_sample
+        # La tokenizzazione con padding modifica lo stato del tokenizer Rust: una copia per thread
+        self._local = threading.local()
+
+    def _worker_tokenizer(self):
+        if not hasattr(self._local, 'tokenizer'):
+            self._local.tokenizer = copy.deepcopy(self.tokenizer)
+        return self._local.tokenizer
+
+    def run_request(self, rows):
+        """Serve one request; returns (latency in seconds, DecodingStats, grammar of every row)."""
+        names = [name for name, _ in rows]
+        if len(rows) == 1:
+            logit_processor, streamer = self.grammars[names[0]].session()
+            text = rows[0][1]
+        else:
+            logit_processor, streamer = generate_batch_grammar_parameters(
+                self.tokenizer, [self.grammars[name] for name in names])
+            text = [prompt for _, prompt in rows]
+
+        start = time.perf_counter()
+        _, stats = generate_text(self.model, self._worker_tokenizer(), text, logit_processor, streamer,
+                                 max_new_tokens=self.max_new_tokens, do_sample=self.do_sample, return_stats=True)
+        return time.perf_counter() - start, stats, names
+
+    def run(self, plan, concurrency):
+        """Serve `plan` with `concurrency` workers; returns (wall-clock seconds, results in completion order)."""
+        results = []
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for result in executor.map(self.run_request, plan):
+                results.append(result)
+        return time.perf_counter() - start, results
+
+
+def summarise(wall_seconds, results):
+    latencies = [latency for latency, _, _ in results]
+    total = DecodingStats()
+    per_grammar = {}
+    for _, stats, names in results:
+        total.merge(stats)
+        # In un batch misto i tempi sono della richiesta intera: vengono attribuiti a ogni grammatica presente
+        for name in set(names):
+            per_grammar.setdefault(name, DecodingStats()).merge(stats)
+
+    per_token = [latency / stats.tokens * 1000 for latency, stats, _ in results if stats.tokens]
+    report = {
+        'requests': len(results),
+        'wall_seconds': wall_seconds,
+        'requests_per_second': len(results) / wall_seconds,
+        'tokens': total.tokens,
+        'tokens_per_second': total.tokens / wall_seconds,
+        'latency_ms': {f"p{q}": percentile(latencies, q) * 1000 for q in (50, 90, 99)},
+        'ms_per_token': {f"p{q}": percentile(per_token, q) for q in (50, 99)} if per_token else {},
+        'model_seconds': total.model_seconds,
+        'grammar_seconds': total.grammar_seconds,
+        'grammar_share': total.grammar_seconds / total.generation_seconds if total.generation_seconds else 0.0,
+        'stats': total.as_dict(),
+        'per_grammar': {name: stats.as_dict() for name, stats in sorted(per_grammar.items())},
+    }
+    report['latency_ms']['max'] = max(latencies) * 1000
+    return report
+
+
+def print_report(report):
+    latency, per_token = report['latency_ms'], report['ms_per_token']
+    print(f"requests {report['requests']} in {report['wall_seconds']:.2f}s: "
+          f"{report['requests_per_second']:.2f} req/s, {report['tokens_per_second']:.1f} tokens/s "
+          f"({report['tokens']} tokens)")
+    print(f"latency ms: p50 {latency['p50']:.1f}  p90 {latency['p90']:.1f}  p99 {latency['p99']:.1f}  "
+          f"max {latency['max']:.1f}")
+    if per_token:
+        print(f"ms per token: p50 {per_token['p50']:.2f}  p99 {per_token['p99']:.2f}")
+    print(f"model {report['model_seconds']:.2f}s  grammar {report['grammar_seconds']:.2f}s "
+          f"({report['grammar_share']:.1%} of the generation time)")
+    print(f"{'grammar':<16} {'tokens':>8} {'grammar s':>10} {'share':>7} {'allowed/step':>13} {'cache hits':>11}")
+    for name, stats in report['per_grammar'].items():
+        share = stats['grammar_seconds'] / stats['generation_seconds'] if stats['generation_seconds'] else 0.0
+        print(f"{name:<16} {stats['tokens']:>8} {stats['grammar_seconds']:>10.3f} {share:>7.1%} "
+              f"{stats['mean_allowed_tokens']:>13.1f} {stats['cache_hit_rate']:>11.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mix', nargs='+', default=['classification=2', 'vocabulary=1', 'rdf=1'],
+                        help=f"grammars as name[=weight], among: {', '.join(sorted(GRAMMAR_FACTORIES))}")
+    parser.add_argument('--concurrency', type=int, default=4, help="requests in flight (worker threads)")
+    parser.add_argument('--batch-size', type=int, default=1, help="prompts per request")
+    parser.add_argument('--requests', type=int, default=32)
+    parser.add_argument('--warmup', type=int, default=2, help="untimed requests served first")
+    parser.add_argument('--max-new-tokens', type=int, default=32)
+    parser.add_argument('--do-sample', action='store_true')
+    parser.add_argument('--vocab-size', type=int, default=32000)
+    parser.add_argument('--hidden-size', type=int, default=256)
+    parser.add_argument('--layers', type=int, default=4)
+    parser.add_argument('--torch-threads', type=int, help="intra-op threads of torch (default: torch's)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write the report to this JSON file")
+    args = parser.parse_args()
+
+    if args.torch_threads:
+        torch.set_num_threads(args.torch_threads)
+    torch.manual_seed(args.seed)
+    mix = parse_mix(args.mix)
+
+    start = time.perf_counter()
+    tokenizer = build_tokenizer(args.vocab_size)
+    model = build_model(tokenizer, hidden_size=args.hidden_size, num_layers=args.layers)
+    grammars = {}
+    for name in mix:
+        productions, regex_dict = GRAMMAR_FACTORIES[name]()
+        grammars[name] = compile_grammar(tokenizer, productions, regex_dict=regex_dict)
+    print(f"vocab={len(tokenizer)} model={sum(p.numel() for p in model.parameters()) / 1e6:.1f}M parameters "
+          f"grammars={', '.join(mix)} set up in {time.perf_counter() - start:.1f}s; "
+          f"concurrency={args.concurrency} batch={args.batch_size} torch threads={torch.get_num_threads()}",
+          file=sys.stderr)
+
+    load_test = LoadTest(model, tokenizer, grammars, args.max_new_tokens, args.do_sample)
+    plan = plan_requests(mix, args.warmup + args.requests, args.batch_size, args.seed)
+    for rows in plan[:args.warmup]:
+        load_test.run_request(rows)
+    wall_seconds, results = load_test.run(plan[args.warmup:], args.concurrency)
+
+    report = summarise(wall_seconds, results)
+    print_report(report)
+    if args.output:
+        config = {name: value for name, value in vars(args).items() if name != 'output'}
+        config['torch_threads'] = torch.get_num_threads()
+        with open(args.output, 'w') as f:
+            json.dump({'config': config, 'report': report}, f, indent=1, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
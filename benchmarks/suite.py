@@ -0,0 +1,218 @@
+"""
+Offline benchmark suite: grammar compile time and memory, and per-step cost of the constraint.
+
+Every grammar family of synthetic.FAMILIES (a wide tag list, a deep IRI trie, the RDF grammar of
+main.py and a regex-heavy grammar) is compiled against synthetic byte-level BPE vocabularies
+(32k and 128k entries by default), with no network access and no model. For each case it measures:
+
+* compile time, best of `--repeat`, in total and per phase (process_full_grammar, parsing_table,
+  generate_token_maps, token masks);
+* memory: peak Python allocations during the compilation (tracemalloc, which does not see the memory
+  of torch tensors) and size of the token masks (the tensors);
+* per-step cost on a random walk through the grammar (random logits, argmax among the allowed
+  tokens), best of `--repeat` walks: allowed-set lookup, mask build, mask apply and PDA
+  transition, in microseconds.
+
+With `--output` the results are written as JSON; with `--baseline` they are compared with a stored
+run and the command exits with status 1 if a metric is worse than the baseline by more than
+`--tolerance` (and by more than a small absolute noise floor). The per-step figures include the cold
+cache misses spread over the walk, so a baseline is only compared with runs of the same `--steps`
+and `--repeat` (status 2 otherwise).
+
+Timings depend on the machine, so no baseline is kept in the repository. To check a change, record
+the baseline on the reference machine from the commit the change is based on, then run the suite
+with the same settings on the change (raise `--repeat` if the machine is noisy):
+
+    git switch main && python -m benchmarks.suite --repeat 5 --output /tmp/baseline.json
+    git switch my-change && python -m benchmarks.suite --repeat 5 --baseline /tmp/baseline.json --tolerance 0.3
+
+    python -m benchmarks.suite --vocab-sizes 32000 --families rdf regex_heavy --steps 500
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import torch
+
+from grammarllm import DecodingStats, compile_grammar
+
+from .synthetic import FAMILIES, build_tokenizer
+
+# Metriche confrontate con la baseline (più basso è meglio) e variazione assoluta sotto cui sono rumore
+METRICS = {
+    'compile_seconds': 0.02,
+    'process_full_grammar': 0.02,
+    'parsing_table': 0.02,
+    'generate_token_maps': 0.02,
+    'token_masks': 0.02,
+    'compile_peak_mb': 1.0,
+    'masks_mb': 1.0,
+    'step_us': 10.0,
+    'allowed_set_us': 5.0,
+    'mask_build_us': 5.0,
+    'mask_apply_us': 5.0,
+    'transition_us': 5.0,
+}
+
+
+def measure_compile(tokenizer, productions, regex_dict, repeat):
+    """Best compile time (total and per phase) over `repeat` runs, then peak memory of one more run."""
+    best = None
+    for _ in range(repeat):
+        # Come timeit: il garbage collector è disattivato durante la misura
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            grammar = compile_grammar(tokenizer, productions, regex_dict=regex_dict)
+            elapsed = time.perf_counter() - start
+        finally:
+            gc.enable()
+        if best is None or elapsed < best['compile_seconds']:
+            best = dict(grammar.compile_times, compile_seconds=elapsed)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        grammar = compile_grammar(tokenizer, productions, regex_dict=regex_dict)
+        best['compile_peak_mb'] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    finally:
+        tracemalloc.stop()
+    best['masks_mb'] = sum(ids.numel() * ids.element_size() for ids in grammar.masks.terminal_ids.values()) / 2 ** 20
+    return grammar, best
+
+
+def measure_steps(grammar, steps, seed=0):
+    """Per-step cost (us) of the grammar on a random walk: at every step the argmax of random logits is generated."""
+    generator = torch.Generator().manual_seed(seed)
+    eos_token_id = grammar.tokenizer.eos_token_id
+    processor, streamer = grammar.session()
+    stats = processor.stats = streamer.stats = DecodingStats()
+    prompt = torch.zeros((1, 1), dtype=torch.long)
+    scores = torch.empty((1, len(grammar.tokenizer)))
+
+    streamer.put(prompt)
+    for _ in range(steps):
+        scores.uniform_(generator=generator)
+        token = processor(prompt, scores).argmax(dim=-1)
+        streamer.put(token)
+        if int(token) == eos_token_id or processor.pda.eos():
+            # Frase completa: si riparte dallo stato iniziale
+            processor.reset()
+            streamer.reset()
+            streamer.put(prompt)
+
+    per_step = {
+        'allowed_set_us': stats.allowed_set_seconds,
+        'mask_build_us': stats.mask_build_seconds,
+        'mask_apply_us': stats.mask_apply_seconds,
+        'transition_us': stats.transition_seconds,
+    }
+    per_step = {name: seconds / steps * 1e6 for name, seconds in per_step.items()}
+    per_step['step_us'] = sum(per_step.values())
+    per_step['mean_allowed_tokens'] = stats.mean_allowed_tokens
+    per_step['cache_hit_rate'] = stats.cache_hit_rate
+    return per_step
+
+
+def run_suite(vocab_sizes, families, steps, repeat):
+    results = {}
+    for vocab_size in vocab_sizes:
+        start = time.perf_counter()
+        tokenizer = build_tokenizer(vocab_size)
+        print(f"vocabulary of {len(tokenizer)} tokens built in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+        for family in families:
+            productions, regex_dict = FAMILIES[family]()
+            grammar, case = measure_compile(tokenizer, productions, regex_dict, repeat)
+            case['non_terminals'] = len(grammar.pars_tab)
+            case['terminals'] = len(grammar.map_terminal_tokens)
+            # Stessa passeggiata (stesso seed) ripetuta: si tiene la più veloce, come per la compilazione
+            case.update(min((measure_steps(grammar, steps) for _ in range(repeat)), key=lambda run: run['step_us']))
+            results[f"{family}/{vocab_size // 1000}k"] = case
+            print_case(f"{family}/{vocab_size // 1000}k", case)
+    return results
+
+
+def print_case(name, case):
+    print(f"{name:<22} compile {case['compile_seconds']:>7.3f}s "
+          f"(rules {case['process_full_grammar']:.3f} table {case['parsing_table']:.3f} "
+          f"maps {case['generate_token_maps']:.3f} masks {case['token_masks']:.3f})  "
+          f"peak {case['compile_peak_mb']:>6.1f}MB  step {case['step_us']:>7.1f}us "
+          f"(allowed {case['allowed_set_us']:.1f} build {case['mask_build_us']:.1f} "
+          f"apply {case['mask_apply_us']:.1f} transition {case['transition_us']:.1f})")
+
+
+def compare(results, baseline, tolerance):
+    """Regressions of `results` with respect to `baseline`: list of (case, metric, baseline value, new value)."""
+    regressions = []
+    for name, case in results.items():
+        reference = baseline.get(name)
+        if reference is None:
+            print(f"{name}: not in the baseline", file=sys.stderr)
+            continue
+        for metric, noise in METRICS.items():
+            if metric not in case or metric not in reference:
+                continue
+            old, new = reference[metric], case[metric]
+            if new > old * (1 + tolerance) and new - old > noise:
+                regressions.append((name, metric, old, new))
+    return regressions
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'torch': torch.__version__,
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'torch_threads': torch.get_num_threads(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--vocab-sizes', type=int, nargs='+', default=[32000, 128000])
+    parser.add_argument('--families', nargs='+', choices=sorted(FAMILIES), default=list(FAMILIES))
+    parser.add_argument('--steps', type=int, default=2000, help="steps of the random walk of every case")
+    parser.add_argument('--repeat', type=int, default=3, help="compilations and walks per case (the best is kept)")
+    parser.add_argument('--output', help="write the results to this JSON file (e.g. to refresh the baseline)")
+    parser.add_argument('--baseline', help="JSON file of a previous run to compare with")
+    parser.add_argument('--tolerance', type=float, default=0.3, help="allowed relative slowdown")
+    args = parser.parse_args()
+
+    config = {'steps': args.steps, 'repeat': args.repeat, 'environment': environment()}
+    baseline = None
+    if args.baseline:
+        # Controllata prima di eseguire la suite: con impostazioni diverse il confronto non ha senso
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        mismatched = [name for name in ('steps', 'repeat') if baseline['config'][name] != config[name]]
+        if mismatched:
+            settings = " ".join(f"--{name} {baseline['config'][name]}" for name in mismatched)
+            print(f"Not comparable: the baseline was recorded with {settings}", file=sys.stderr)
+            sys.exit(2)
+
+    results = run_suite(args.vocab_sizes, args.families, args.steps, args.repeat)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'config': config, 'results': results}, f, indent=1, sort_keys=True)
+
+    if baseline is not None:
+        if baseline['config']['environment'] != config['environment']:
+            print(f"Warning: the baseline was recorded in another environment {baseline['config']['environment']}", file=sys.stderr)
+        regressions = compare(results, baseline['results'], args.tolerance)
+        for name, metric, old, new in regressions:
+            print(f"REGRESSION {name} {metric}: {old:.4g} -> {new:.4g} ({new / old - 1:+.0%})")
+        if regressions:
+            sys.exit(1)
+        print(f"No regression beyond {args.tolerance:.0%} with respect to {args.baseline}")
+
+
+if __name__ == '__main__':
+    main()
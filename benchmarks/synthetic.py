@@ -0,0 +1,161 @@
+"""
+Synthetic tokenizer, model and grammars for the offline benchmarks.
+
+Nothing is downloaded: the tokenizer is a byte-level BPE trained on a generated corpus (so the
+vocabulary size can be chosen, e.g. 32k or 128k entries) and the model is a randomly initialised
+Llama of configurable size. Outputs are meaningless, but the shapes and the costs of the grammar
+machinery (vocabulary scans, masks, parser steps) are those of a real setup.
+"""
+import itertools
+import random
+import re
+
+import torch
+from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+from transformers import LlamaConfig, LlamaForCausalLM, PreTrainedTokenizerFast
+
+# Testo di dominio: le parole delle grammatiche diventano token interi del vocabolario
+DOMAIN_TEXT = [
+    "positive happy peaceful joyful negative sad angry frustrated neutral calm indifferent unemotional",
+    "Yes I'm very happy ! so really excited today thanks you much great good fine amazing",
+    "<http://example.org/people/MarioRossi> <http://example.org/properties/hasAge> \"40\" "
+    "^^<http://www.w3.org/2001/XMLSchema#integer> . _:b1 @en it en fr sp",
+    "The quick brown fox jumps over the lazy dog 0123456789 (x) [y] {z} http www org example people "
+    "properties XMLSchema decimal string integer",
+]
+
+SYLLABLES = ["ka", "lo", "mi", "ne", "ru", "sa", "to", "vi", "ze", "po", "qua", "bre", "sti", "gno",
+             "ph", "th", "ar", "el", "in", "os", "um", "er", "an", "ion", "ment", "ing", "ed", "ly"]
+
+
+def synthetic_corpus(n_words, seed=0):
+    """Pseudo-words made of random syllables, plus IRIs and numbers, to reach large vocabularies."""
+    rng = random.Random(seed)
+    corpus = []
+    for i in range(n_words):
+        word = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 6)))
+        if i % 7 == 0:
+            word = f"http://example.org/{word}/{rng.randint(0, 9999)}"
+        elif i % 11 == 0:
+            word = word.capitalize() + str(rng.randint(0, 999))
+        corpus.append(word)
+    return corpus
+
+
+def build_tokenizer(vocab_size=32000, seed=0):
+    """Byte-level BPE tokenizer with (at most) `vocab_size` entries, `<eos>` and `<pad>` special tokens."""
+    corpus = DOMAIN_TEXT * 20 + [word for line in DOMAIN_TEXT for word in line.split()] * 20
+    corpus += synthetic_corpus(max(vocab_size * 4, 10000), seed)
+
+    tokenizer = Tokenizer(models.BPE())
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    trainer = trainers.BpeTrainer(vocab_size=vocab_size, special_tokens=["<eos>", "<pad>"], show_progress=False,
+                                  initial_alphabet=pre_tokenizers.ByteLevel.alphabet())
+    tokenizer.train_from_iterator(corpus, trainer)
+    return PreTrainedTokenizerFast(tokenizer_object=tokenizer, eos_token="<eos>", pad_token="<pad>")
+
+
+def build_model(tokenizer, hidden_size=256, num_layers=4, vocab_size=None, seed=0):
+    """Randomly initialised Llama; `vocab_size` may exceed the tokenizer's to emulate a larger output head."""
+    torch.manual_seed(seed)
+    config = LlamaConfig(vocab_size=vocab_size or len(tokenizer), hidden_size=hidden_size,
+                         intermediate_size=hidden_size * 2, num_hidden_layers=num_layers,
+                         num_attention_heads=max(1, hidden_size // 64), num_key_value_heads=max(1, hidden_size // 64),
+                         max_position_embeddings=2048, eos_token_id=tokenizer.eos_token_id,
+                         pad_token_id=tokenizer.pad_token_id)
+    return LlamaForCausalLM(config).eval()
+
+
+CLASSIFICATION = {
+    'S*': ["<<positive >> A", "<<negative >> B", "<<neutral >> C"],
+    'A': ["<<happy>>", "<<peaceful>>", "<<joyful>>"],
+    'B': ["<<sad>>", "<<angry>>", "<<frustrated>>"],
+    'C': ["<<calm>>", "<<indifferent>>", "<<unemotional>>"],
+}
+
+VOCABULARY = {
+    'S*': [f"<< {word}>> S*" for word in
+           "Yes I'm very happy ! so really excited today thanks you much great good fine amazing".split()],
+}
+
+RDF = {
+    'S*': ["SUBJ PRED OBJ . S*"],
+    'SUBJ': ["IRI", "BLANKNODE"],
+    'PRED': ["IRI"],
+    'OBJ': ["IRI", "BLANKNODE", "LITERAL"],
+    'IRI': ["< URI >"],
+    'BLANKNODE': ["<<_:>> NAME"],
+    'LITERAL': ["\" STRING \" DESCRIPTION_LANG"],
+    'DESCRIPTION_LANG': ["^^ IRI", "@ LANGTAG", "ε"],
+    'URI': ["<<http://example.org/people/MarioRossi>>", "<<http://example.org/people/LuisaVerdi>>",
+            "<<http://example.org/people/GiovanniBianchi>>", "<<http://example.org/properties/hasAge>>",
+            "<<http://example.org/properties/hasProfession>>", "<<http://example.org/properties/hasSalary>>",
+            "<<http://www.w3.org/2001/XMLSchema#decimal>>", "<<http://www.w3.org/2001/XMLSchema#integer>>",
+            "<<http://www.w3.org/2001/XMLSchema#string>>"],
+    'STRING': ["alfanum STRING", "ε"],
+    'NAME': ["ids NAME_C"],
+    'NAME_C': ["idc NAME_C", "ε"],
+    'LANGTAG': ["<<it >>", "<<en >>", "<<fr >>", "<<sp >>"],
+}
+
+RDF_REGEX = {
+    'regex_alfanum': re.compile(r"[a-zA-Z0-9]+"),
+    'regex_<': re.compile(r"^<$"),
+    'regex_>': re.compile(r"^>$"),
+    'regex_"': re.compile(r'^\"$'),
+    'regex_^^': re.compile(r"^\^\^$"),
+    'regex_@': re.compile(r"^@$"),
+    'regex_.': re.compile(r"^\.$"),
+    'regex_ids': re.compile(r'[A-Za-z_][A-Za-z0-9_-]*'),
+    'regex_idc': re.compile(r'(?![A-Za-z_])[0-9_-][A-Za-z0-9_-]*'),
+}
+
+# nome -> (produzioni, regex_dict)
+GRAMMARS = {
+    'classification': (CLASSIFICATION, None),
+    'vocabulary': (VOCABULARY, None),
+    'rdf': (RDF, RDF_REGEX),
+}
+
+
+def wide_tags(n_tags=5000, seed=0):
+    """Flat list of `n_tags` multi-token tags, as a large label set: S* -> <<tag>>."""
+    words = list(dict.fromkeys(synthetic_corpus(n_tags * 2, seed + 1)))[:n_tags]
+    return {'S*': [f"<<{word}>>" for word in words]}, None
+
+
+def iri_trie(fanout=8, depth=4, seed=0):
+    """`fanout ** depth` IRIs with long shared prefixes, as the entities of an ontology: S* -> <<iri>> S*."""
+    rng = random.Random(seed)
+    levels = [["".join(rng.choice(SYLLABLES) for _ in range(3)) for _ in range(fanout)] for _ in range(depth)]
+    iris = ["http://example.org/" + "/".join(path) for path in itertools.product(*levels)]
+    return {'S*': ["URI S*"], 'URI': [f"<<{iri}>>" for iri in iris]}, None
+
+
+# Record chiave=valore; tutti i terminali sono regex, quindi ognuno richiede la scansione del vocabolario
+REGEX_HEAVY = {
+    'S*': ["key = VALUE ; S*"],
+    'VALUE': ["number UNIT", "word", "quote TEXT quote"],
+    'UNIT': ["unit", "ε"],
+    'TEXT': ["alfanum TEXT", "ε"],
+}
+
+REGEX_HEAVY_REGEX = {
+    'regex_key': re.compile(r"^[A-Z][a-z]+$"),
+    'regex_=': re.compile(r"^=$"),
+    'regex_;': re.compile(r"^;$"),
+    'regex_number': re.compile(r"^[0-9]+$"),
+    'regex_unit': re.compile(r"^(kg|km|cm|ms|mb|%)$"),
+    'regex_word': re.compile(r"^[a-z]+$"),
+    'regex_quote': re.compile(r'^"$'),
+    'regex_alfanum': re.compile(r"^(Ġ)?[A-Za-z0-9]+$"),
+}
+
+# Famiglie di grammatiche per la suite di benchmark: nome -> funzione che restituisce (produzioni, regex_dict)
+FAMILIES = {
+    'wide_tags': wide_tags,
+    'iri_trie': iri_trie,
+    'rdf': lambda: (RDF, RDF_REGEX),
+    'regex_heavy': lambda: (REGEX_HEAVY, REGEX_HEAVY_REGEX),
+}
@@ -1,18 +1,32 @@
 from .generate_with_constraints import (
     get_parsing_table_and_map_tt,
+    compile_grammar,
     generate_grammar_parameters,
+    generate_batch_grammar_parameters,
     generate_text,
+    rank_candidates,
     setup_logging,
 )
 from .utils.toolbox import create_prompt, chat_template
+from .modules.PrefixCache import PrefixCache
+from .modules.CompiledGrammar import CompiledGrammar
+from .modules.DecodingStats import DecodingStats
 from .utils.common_regex import regex_dict
+from .utils.diagnostics import set_debug
 
 __all__ = [
     "get_parsing_table_and_map_tt",
+    "compile_grammar",
+    "CompiledGrammar",
+    "DecodingStats",
     "generate_grammar_parameters",
+    "generate_batch_grammar_parameters",
     "generate_text",
+    "rank_candidates",
     "setup_logging",
+    "set_debug",
     "create_prompt",
+    "PrefixCache",
     "regex_dict",
     "chat_template"
 ]
\ No newline at end of file
@@ -1,42 +1,130 @@
 from .scripts.grammar_generation import ProductionRuleProcessor
 from .scripts.map_terminal_tokens import generate_token_maps
 from .scripts.generate_LL1_parsing_table import parsing_table
+from .scripts.grammar_cache import grammar_cache_key, save_compiled_grammar, load_compiled_grammar
+from .scripts.enumerate_sentences import enumerate_sentences
 
 from .modules.BaseStreamer import BaseStreamer
-from .modules.PushdownAutomaton import PushdownAutomaton
 from .modules.SimpleLogitProcessor import MaskLogitsProcessor
+from .modules.BeamLogitProcessor import BeamMaskLogitsProcessor
+from .modules.CompiledGrammar import CompiledGrammar
+from .modules.DecodingStats import DecodingStats
+from .modules.RestrictedHead import RestrictedHead
+from .utils import diagnostics
 
 import logging
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-def get_parsing_table_and_map_tt(tokenizer, productions, regex_dict=None):
+import torch
+from transformers import LogitsProcessorList, TemperatureLogitsWarper, TopKLogitsWarper, TopPLogitsWarper
 
-    processor = ProductionRuleProcessor(tokenizer=tokenizer)
+def get_parsing_table_and_map_tt(tokenizer, productions, regex_dict=None, cache_dir=None, minimise=False, timings=None,
+                                 max_workers=1, mp_context=None):
+    """
+    Compile the grammar into the parsing table and the terminal -> token ids map.
+
+    If `cache_dir` is given, the compiled grammar is stored there as an artifact keyed by a hash of
+    (productions, regex_dict patterns, tokenizer vocabulary and definition) and later calls load it
+    (memory-mapped) instead of recompiling.
+
+    With `minimise=True` tag suffix sub-trees that accept the same token sequences share a single
+    non-terminal (a minimal acyclic automaton), which shrinks the parsing table of large tag sets.
+
+    If a `timings` dict is given, it receives the seconds spent in each compile phase.
+
+    The vocabulary scan of the regex terminals is serial unless `max_workers` > 1 (None: one process
+    per CPU) is given, for vocabularies of at least 64k tokens; `mp_context` is the multiprocessing
+    context of the process pool (see scan_vocabulary).
+    """
+    timings = {} if timings is None else timings
+    if cache_dir is not None:
+        artifact_path = os.path.join(cache_dir, grammar_cache_key(tokenizer, productions, regex_dict, minimise))
+        if os.path.isdir(artifact_path):
+            start = time.perf_counter()
+            compiled = load_compiled_grammar(artifact_path)
+            timings["load_compiled_grammar"] = time.perf_counter() - start
+            return compiled
+
+    processor = ProductionRuleProcessor(tokenizer=tokenizer, minimise=minimise)
     # Process the grammar productions
+    start = time.perf_counter()
     final_grammar, tag_mapping = processor.process_full_grammar(productions)
+    timings["process_full_grammar"] = time.perf_counter() - start
 
     #add eos token to the grammar
     final_grammar[('S*','RULE')].append([tokenizer.eos_token])
     # Generate parsing table
+    start = time.perf_counter()
     pars_tab = parsing_table(final_grammar)
+    timings["parsing_table"] = time.perf_counter() - start
 
     # Generate token maps
-    if regex_dict:
-        map_terminal_tokens = generate_token_maps(tokenizer, pars_tab, regex_dict)
-    else:
-        map_terminal_tokens = generate_token_maps(tokenizer, pars_tab)
+    start = time.perf_counter()
+    map_terminal_tokens = generate_token_maps(tokenizer, pars_tab, regex_dict or None,
+                                              max_workers=max_workers, mp_context=mp_context)
+    timings["generate_token_maps"] = time.perf_counter() - start
+    logging.info("Tempi di compilazione: " + ", ".join(f"{phase} {seconds:.3f}s" for phase, seconds in timings.items()))
 
     # uncomment the following lines to log the parsing table and terminal token mappings
     # logging.info("\nMap Terminal Tokens:\n")
     # for key, values in map_terminal_tokens.items():
     #     logging.info(f"{key} -> {values}")
 
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        save_compiled_grammar(artifact_path, pars_tab, map_terminal_tokens)
+
     return pars_tab, map_terminal_tokens
 
+def compile_grammar(tokenizer, productions, regex_dict=None, cache_dir=None, minimise=False, device="cpu",
+                    max_workers=1, mp_context=None):
+    """
+    Compile the grammar once into a read-only CompiledGrammar (parsing table, token maps, masks and
+    caches), to be shared by all the requests: `session()` gives the (logit_processor, streamer) pair
+    of a single request. Arguments as in get_parsing_table_and_map_tt; `device` is where the masks live.
+    The seconds spent in each compile phase are in the `compile_times` attribute of the result.
+    The artifact of `cache_dir` stores the parsing table and the token ids: the masks are rebuilt from them
+    on every call (the `token_masks` phase), which is cheap next to the vocabulary scan it saves.
+    """
+    timings = {}
+    pars_tab, map_terminal_tokens = get_parsing_table_and_map_tt(tokenizer, productions, regex_dict=regex_dict,
+                                                                 cache_dir=cache_dir, minimise=minimise, timings=timings,
+                                                                 max_workers=max_workers, mp_context=mp_context)
+    start = time.perf_counter()
+    grammar = CompiledGrammar(tokenizer, pars_tab, map_terminal_tokens, device=device)
+    timings["token_masks"] = time.perf_counter() - start
+    grammar.compile_times = timings
+    return grammar
+
 def generate_grammar_parameters(tokenizer, pars_tab, map_terminal_tokens):
     # Create Pushdown Automaton and initialize processors and streamer
-    pda = PushdownAutomaton(grammar=pars_tab, startSymbol='S*', map=map_terminal_tokens)
-    return MaskLogitsProcessor(tokenizer, pda), BaseStreamer(tokenizer, pda)
+    # Precompile one vocabulary mask per terminal, reused at every decoding step
+    # (to serve many requests with the same grammar use compile_grammar() and its sessions)
+    return CompiledGrammar(tokenizer, pars_tab, map_terminal_tokens).session()
+
+def generate_batch_grammar_parameters(tokenizer, grammars):
+    """
+    Create a LogitProcessor and a Streamer for a batch whose rows may use different grammars.
+
+    `grammars` holds one (pars_tab, map_terminal_tokens) pair or CompiledGrammar per row, in the same
+    order as the prompts passed to generate_text(). Rows that share a grammar also share its masks and caches.
+    """
+    compiled = {}
+    pdas = []
+    for grammar in grammars:
+        if not isinstance(grammar, CompiledGrammar):
+            key = tuple(id(part) for part in grammar)
+            if key not in compiled:
+                compiled[key] = CompiledGrammar(tokenizer, *grammar)
+            grammar = compiled[key]
+        pdas.append(grammar.new_pda())
+
+    logit_processor, streamer = MaskLogitsProcessor(tokenizer, pdas[0]), BaseStreamer(tokenizer, pdas[0])
+    logit_processor.pdas = pdas
+    streamer.pdas = pdas
+    return logit_processor, streamer
 
 def setup_logging():
     """Setup logging configuration."""
@@ -50,49 +138,333 @@ def setup_logging():
         filemode='w+'  # Overwrites the file every time
     )
 
-def generate_text(model, tokenizer, text, logit_processor, streamer, chat_template = None, max_new_tokens=400, do_sample=False, temperature=None, top_p=None, **kwargs):
+def _is_prompt_batch(text):
+    """True se `text` è una lista di prompt (stringhe o conversazioni) e non una singola conversazione."""
+    return isinstance(text, list) and len(text) > 0 and all(isinstance(t, (str, list)) for t in text)
+
+def _tokenize_prompts(tokenizer, text, chat_template):
+    """Tokenizza un prompt o un batch di prompt (con padding a sinistra)."""
+    is_batch = _is_prompt_batch(text)
+    is_chat = isinstance(text, list) and (not is_batch or isinstance(text[0], list))
+
+    padding_side = getattr(tokenizer, "padding_side", "right")
+    pad_token = tokenizer.pad_token
+    if is_batch:
+        if pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+        tokenizer.padding_side = "left"  # i modelli decoder-only generano a destra del prompt
+
+    try:
+        # TO USE WHEN CREATE PROMPT IS USED AND PROMPT IS A LIST
+        if is_chat:
+            if chat_template is None:
+                raise ValueError("Chat template must be specified")
+            tokenizer.chat_template = chat_template
+            tokenized_input = tokenizer.apply_chat_template(text,
+                                                        tokenize=True,
+                                                        add_generation_prompt=True,
+                                                        return_dict=True,
+                                                        padding=is_batch,
+                                                        return_tensors="pt")
+            #logging.info(tokenized_input) #DEBUG
+        else:
+            tokenized_input = tokenizer(text, return_tensors="pt", padding=is_batch)
+    finally:
+        # Il tokenizer dell'utente torna com'era (padding a eos solo per questa chiamata)
+        tokenizer.padding_side = padding_side
+        if tokenizer.pad_token != pad_token:
+            tokenizer.pad_token = pad_token
+
+    return tokenized_input, is_batch
+
+def _bind_batch_pdas(logit_processor, streamer, batch_size):
+    """Assegna al processor e allo streamer un PDA per ogni riga del batch."""
+    if len(logit_processor.pdas) == batch_size:
+        return
+    if len(logit_processor.pdas) > 1:
+        raise ValueError(f"Il processor ha {len(logit_processor.pdas)} PDA ma il batch contiene {batch_size} prompt.")
+    pda = logit_processor.pda
+    pdas = [pda] + [pda.spawn() for _ in range(batch_size - 1)]
+    logit_processor.pdas = pdas
+    streamer.pdas = pdas
+
+def _sampling_warpers(model, temperature, top_p):
+    """Warper di temperatura, top-k e top-p, con i default della generation_config del modello."""
+    config = model.generation_config
+    temperature = temperature if temperature is not None else config.temperature
+    top_k = getattr(config, "top_k", None)
+    top_p = top_p if top_p is not None else config.top_p
+
+    warpers = LogitsProcessorList()
+    if temperature is not None and temperature != 1.0:
+        warpers.append(TemperatureLogitsWarper(temperature))
+    if top_k:
+        warpers.append(TopKLogitsWarper(top_k))
+    if top_p is not None and top_p < 1.0:
+        warpers.append(TopPLogitsWarper(top_p))
+    return warpers
+
+def _run_model(model, head, pending, attention_mask, past_key_values):
+    """Forward dei token `pending`: restituisce i logit dell'ultima posizione (o l'hidden state, con `head`) e la KV cache."""
+    if head is not None:
+        return head.forward(input_ids=pending, attention_mask=attention_mask, past_key_values=past_key_values, use_cache=True)
+    outputs = model(input_ids=pending, attention_mask=attention_mask, past_key_values=past_key_values, use_cache=True)
+    return outputs.logits[:, -1, :].float(), outputs.past_key_values
+
+def _step_logits(head, output, pda):
+    """Logit del passo corrente: con `head` la proiezione è calcolata ora, sui token ammessi dallo stato del PDA."""
+    return head.logits(output, pda) if head is not None else output
+
+def _sample_next(logit_processor, sequence, logits, do_sample, warpers):
+    """Applica la grammatica ai logit e sceglie il prossimo token (greedy o campionamento)."""
+    scores = logit_processor(sequence, logits)
+    if do_sample:
+        scores = warpers(sequence, scores)
+        return torch.multinomial(torch.softmax(scores, dim=-1), num_samples=1)
+    return torch.argmax(scores, dim=-1, keepdim=True)
+
+def _token_to_host(token):
+    """Copia asincrona del token campionato sulla CPU: restituisce la copia e l'evento da attendere (solo CUDA)."""
+    if token.device.type != "cuda":
+        return token, None
+    host = torch.empty(token.shape, dtype=token.dtype, pin_memory=True)
+    host.copy_(token, non_blocking=True)
+    event = torch.cuda.Event()
+    event.record()
+    return host, event
+
+def _advance_pda(streamer, logit_processor, head, pda, host_token, event, scores_shape, device, eos_token_id, forced_budget):
+    """
+    Eseguita sul thread di lavoro mentre il modello elabora il token: transizione del PDA e maschere dello
+    stato successivo (o, con jump-forward, i token forzati che seguono). Restituisce (token, token forzati).
+    """
+    if event is not None:
+        event.synchronize()
+    streamer.put(host_token[0])
+    token = int(host_token.reshape(-1)[0])
+    if token == eos_token_id or pda.eos():
+        return token, []
+
+    run = pda.forced_tokens(forced_budget) if forced_budget else []
+    if not run:
+        # Lo stato non cambierà prima del prossimo passo: maschere pronte per il processor (e per la testa ridotta)
+        logit_processor.prepare(scores_shape, device)
+        if head is not None:
+            head.allowed_ids(pda)
+    return token, run
+
+@torch.no_grad()
+def _pipelined_decode_loop(model, tokenizer, input_ids, attention_mask, logit_processor, streamer, max_new_tokens, do_sample, temperature, top_p, jump_forward=False, head=None, past_key_values=None):
+    """
+    Come _decode_loop, ma il token campionato rientra subito nel modello, senza attendere la CPU:
+    la copia del token sulla CPU, la transizione del PDA e la costruzione della maschera del passo
+    successivo sono eseguite su un thread di lavoro, in parallelo con la forward.
+    """
+    pda = logit_processor.pdas[0]
+    eos_token_id = tokenizer.eos_token_id
+    warpers = _sampling_warpers(model, temperature, top_p) if do_sample else None
+
+    streamer.put(input_ids.cpu())  # come generate(): la prima chiamata contiene il prompt
+    sequence = input_ids
+    # Token non ancora passati al modello: con la KV cache di un prefisso, solo quelli dopo il prefisso
+    pending = input_ids[:, past_key_values.get_seq_length():] if past_key_values is not None else input_ids
+    generated = 0
+    advance = None  # transizione del PDA in corso sul thread di lavoro
+
+    if pda.eos():
+        streamer.end()
+        return sequence
+
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="grammarllm-pda") as executor:
+        while True:
+            attention_mask = torch.cat([attention_mask, attention_mask.new_ones((1, sequence.shape[-1] - attention_mask.shape[-1]))], dim=-1)
+            output, past_key_values = _run_model(model, head, pending, attention_mask, past_key_values)
+            pending = None
+
+            run = []
+            if advance is not None:
+                token, run = advance.result()
+                advance = None
+                if token == eos_token_id or pda.eos():
+                    break
+            elif jump_forward:
+                run = pda.forced_tokens(max_new_tokens - generated)
+
+            if run:
+                # Token forzati: la forward appena eseguita non serve, la prossima li passa tutti insieme al modello
+                if diagnostics.DEBUG:
+                    logging.info(f"Jump-forward di {len(run)} token forzati: {run}")
+                for token in run:
+                    streamer.put(torch.tensor([token]))
+                logit_processor.stats.jump_forward_tokens += len(run)
+                pending = torch.tensor([run], dtype=sequence.dtype, device=sequence.device)
+                sequence = torch.cat([sequence, pending], dim=-1)
+                generated += len(run)
+                if run[-1] == eos_token_id or generated >= max_new_tokens or pda.eos():
+                    break
+                continue
+
+            logits = _step_logits(head, output, pda)
+            next_token = _sample_next(logit_processor, sequence, logits, do_sample, warpers)
+            pending = next_token.to(sequence.dtype)
+            sequence = torch.cat([sequence, pending], dim=-1)
+            generated += 1
+
+            host_token, event = _token_to_host(next_token)
+            forced_budget = max_new_tokens - generated if jump_forward else 0
+            advance = executor.submit(_advance_pda, streamer, logit_processor, head, pda, host_token, event,
+                                      logits.shape, logits.device, eos_token_id, forced_budget)
+            if generated >= max_new_tokens:
+                advance.result()
+                break
+
+    streamer.end()
+    return sequence
+
+@torch.no_grad()
+def _decode_loop(model, tokenizer, input_ids, attention_mask, logit_processor, streamer, max_new_tokens, do_sample, temperature, top_p, jump_forward=True, head=None, past_key_values=None):
+    """
+    Ciclo di decodifica per un singolo prompt.
+    Con jump-forward, quando il PDA ammette un solo token per più passi consecutivi, l'intera sequenza
+    forzata viene accodata senza campionare e passata al modello con un'unica forward multi-token che
+    estende la KV cache. Con `head` (RestrictedHead) i logit sono calcolati solo per i token ammessi.
+    `past_key_values`, se presente, contiene già i primi token del prompt (vedi PrefixCache).
+    """
+    pda = logit_processor.pdas[0]
+    eos_token_id = tokenizer.eos_token_id
+    warpers = _sampling_warpers(model, temperature, top_p) if do_sample else None
+
+    streamer.put(input_ids.cpu())  # come generate(): la prima chiamata contiene il prompt
+    sequence = input_ids
+    # Token non ancora passati al modello: con la KV cache di un prefisso, solo quelli dopo il prefisso
+    pending = input_ids[:, past_key_values.get_seq_length():] if past_key_values is not None else input_ids
+    generated = 0
+
+    while generated < max_new_tokens and not pda.eos():
+        # Token forzati dalla grammatica: nessun campionamento, una sola forward per tutta la sequenza
+        run = pda.forced_tokens(max_new_tokens - generated) if jump_forward else None
+        if run:
+            if diagnostics.DEBUG:
+                logging.info(f"Jump-forward di {len(run)} token forzati: {run}")
+            run_ids = torch.tensor([run], dtype=sequence.dtype, device=sequence.device)
+            for token in run:
+                streamer.put(torch.tensor([token]))
+            logit_processor.stats.jump_forward_tokens += len(run)
+            sequence = torch.cat([sequence, run_ids], dim=-1)
+            pending = run_ids if pending is None else torch.cat([pending, run_ids], dim=-1)
+            generated += len(run)
+            if run[-1] == eos_token_id or generated >= max_new_tokens or pda.eos():
+                break
+
+        # La maschera di attenzione copre anche i token accodati dall'ultima forward
+        attention_mask = torch.cat([attention_mask, attention_mask.new_ones((1, sequence.shape[-1] - attention_mask.shape[-1]))], dim=-1)
+        output, past_key_values = _run_model(model, head, pending, attention_mask, past_key_values)
+        pending = None
+
+        next_token = _sample_next(logit_processor, sequence, _step_logits(head, output, pda), do_sample, warpers)
+
+        streamer.put(next_token[0].cpu())
+        sequence = torch.cat([sequence, next_token.to(sequence.dtype)], dim=-1)
+        pending = next_token.to(sequence.dtype)
+        generated += 1
+        if next_token.item() == eos_token_id:
+            break
+
+    streamer.end()
+    return sequence
+
+def _static_prefix_ids(tokenizer, text):
+    """Token id del prefisso statico di una conversazione: tutti i messaggi tranne l'ultimo (system prompt ed esempi)."""
+    encoded = tokenizer.apply_chat_template(text[:-1], tokenize=True, add_generation_prompt=False, return_dict=True)
+    ids = encoded["input_ids"]
+    return ids[0] if ids and isinstance(ids[0], list) else list(ids)
+
+@torch.no_grad()
+def _prefill_prefix(model, tokenizer, text, input_ids, prefix_cache):
+    """
+    KV cache dei primi token del prompt presa da `prefix_cache`. Se il prefisso statico della conversazione
+    non è ancora in cache (o lo è solo in parte) viene calcolato e salvato. None se non c'è nulla da riusare.
+    """
+    ids = input_ids[0].tolist()
+    static = _static_prefix_ids(tokenizer, text) if isinstance(text, list) and len(text) > 1 else []
+
+    # Solo la parte del prefisso che coincide con i token del prompt, lasciando almeno un token da elaborare
+    length = 0
+    limit = min(len(static), len(ids) - 1)
+    while length < limit and static[length] == ids[length]:
+        length += 1
+
+    cached, past_key_values = prefix_cache.lookup(model, ids)
+    if length > cached:
+        outputs = model(input_ids=input_ids[:, cached:length],
+                        attention_mask=torch.ones((1, length), dtype=torch.long, device=input_ids.device),
+                        past_key_values=past_key_values, use_cache=True)
+        past_key_values = outputs.past_key_values
+        prefix_cache.store(model, ids[:length], past_key_values)
+        cached = length
+    logging.info(f"Prefisso del prompt dalla PrefixCache: {cached} token su {len(ids)}")
+    return past_key_values
+
+def _count_generated(generated, eos_token_id):
+    """Token generati, fino al primo eos compreso di ogni riga (le righe terminate sono poi riempite di padding)."""
+    is_eos = generated == eos_token_id
+    lengths = torch.where(is_eos.any(dim=-1), is_eos.int().argmax(dim=-1) + 1, generated.shape[-1])
+    return int(lengths.sum())
+
+def generate_text(model, tokenizer, text, logit_processor, streamer, chat_template = None, max_new_tokens=400, do_sample=False, temperature=None, top_p=None, jump_forward=False, restricted_head=False, pipeline=False, prefix_cache=None, return_stats=False, **kwargs):
     """
     Genera testo vincolato dalla grammatica, con configurazione dei parametri di generazione sicura.
 
     Args:
         model: Il modello pre-addestrato.
         tokenizer: Il tokenizer del modello.
-        text: Input text iniziale.
+        text: Input text iniziale. Una lista di prompt (stringhe o conversazioni di create_prompt)
+            viene generata in un unico batch, con un PDA separato per ogni riga.
         logit_processor: Processor dei logit basato sulla grammatica.
         streamer: Streamer per l'output live.
         max_new_tokens: Numero massimo di nuovi token da generare.
         do_sample: Se True, abilita la generazione stocastica.
         temperature: Controlla la casualità (usato solo se do_sample=True).
         top_p: Top-p (nucleus sampling), usato solo se do_sample=True.
-        **kwargs: Parametri aggiuntivi opzionali per model.generate().
+        jump_forward: Se True, le sequenze di token forzati dalla grammatica (stati con un solo token
+            ammesso) vengono accodate senza campionare, con un'unica forward multi-token. Solo per un
+            singolo prompt; con parametri aggiuntivi per model.generate() (es. repetition_penalty,
+            stop_strings) si usa model.generate(), con un warning.
+        restricted_head: Se True (o un RestrictedHead già costruito), la proiezione lm_head viene
+            calcolata solo per i token ammessi dalla grammatica. Stessi vincoli di jump_forward.
+        pipeline: Se True, la transizione del PDA e la maschera del passo successivo sono calcolate su un
+            thread di lavoro in parallelo con la forward del modello. Stessi vincoli di jump_forward.
+        prefix_cache: Una PrefixCache: la KV cache del prefisso statico del prompt (system prompt ed esempi
+            di create_prompt) viene riusata tra le chiamate e solo il turno dell'utente passa nel modello.
+            Solo per un singolo prompt.
+        return_stats: Se True restituisce anche i contatori e i tempi della richiesta (DecodingStats):
+            token/s, tempo del modello e della grammatica, dimensione degli insiemi ammessi, cache.
+        **kwargs: Parametri aggiuntivi opzionali per model.generate(). Con num_beams > 1 il beam search
+            tiene uno stato del parser per ogni beam (BeamMaskLogitsProcessor); lo streamer non viene usato.
+
+    Returns:
+        Il testo generato, oppure la lista dei testi generati se `text` è un batch di prompt.
+        Con return_stats=True, la coppia (risultato, DecodingStats).
     """
     
     try:
-        # TO USE WHEN CREATE PROMPT IS USED AND PROMPT IS A LIST
-        if isinstance(text,list):
-            if chat_template is None:
-                raise ValueError("Chat template must be specified")
-            tokenizer.chat_template = chat_template
-            tokenized_input = tokenizer.apply_chat_template(text, 
-                                                        tokenize=True,
-                                                        add_generation_prompt=True,
-                                                        return_dict=True,
-                                                        return_tensors="pt").to(model.device)
-            #logging.info(tokenized_input) #DEBUG
-        else:
-            tokenized_input = tokenizer(text, return_tensors="pt")
+        tokenized_input, is_batch = _tokenize_prompts(tokenizer, text, chat_template)
+        # Ogni richiesta parte dallo stato iniziale della grammatica, anche se processor e streamer sono già stati usati
+        logit_processor.reset()
+        streamer.reset()
+        stats = logit_processor.stats = streamer.stats = DecodingStats()
+        _bind_batch_pdas(logit_processor, streamer, tokenized_input["input_ids"].shape[0])
 
         # Safe defaults
         kwargs.setdefault("num_beams", 1)  # beam search disattivato
         kwargs.setdefault("pad_token_id", tokenizer.eos_token_id)
-
-        # Sicurezza num_beams
-        if kwargs["num_beams"] != 1:
-            logging.warning("⚠️ num_beams > 1 non è compatibile con la generazione vincolata da grammatica. Impostato automaticamente a num_beams=1.")
-            kwargs["num_beams"] = 1
+        beam_search = kwargs["num_beams"] != 1
 
         # Sampling parameters
         if do_sample:
+            # Anche se passati in kwargs: i loop dedicati li ricevono come argomenti espliciti
+            temperature = kwargs.get("temperature") if temperature is None else temperature
+            top_p = kwargs.get("top_p") if top_p is None else top_p
             if temperature is not None:
                 kwargs["temperature"] = temperature
             if top_p is not None:
@@ -114,20 +486,160 @@ def generate_text(model, tokenizer, text, logit_processor, streamer, chat_templa
         
 
         start = input_ids.shape[1]
+        started = time.perf_counter()
 
-        output = model.generate(
-            input_ids=input_ids,
-            attention_mask=attention_mask,
-            do_sample=do_sample,
-            max_new_tokens=max_new_tokens,
-            streamer=streamer,
-            logits_processor=[logit_processor],
-            **kwargs
-        )
+        past_key_values = None
+        if prefix_cache is not None:
+            if is_batch or beam_search:
+                logging.warning("⚠️ prefix_cache supporta un solo prompt senza beam search: non viene usata.")
+            else:
+                past_key_values = _prefill_prefix(model, tokenizer, text, input_ids, prefix_cache)
 
-        answer = tokenizer.decode(output[0][start:], skip_special_tokens=True)
+        if (jump_forward or restricted_head or pipeline) and (is_batch or beam_search):
+            logging.warning("⚠️ jump_forward, restricted_head e pipeline supportano un solo prompt senza beam search: uso model.generate().")
+            jump_forward = restricted_head = pipeline = False
 
-        return answer
+        # I loop dedicati non applicano gli altri parametri di model.generate(): meglio rinunciare al loop che ignorarli
+        unsupported = sorted(set(kwargs) - {"num_beams", "pad_token_id", "temperature", "top_p"})
+        if (jump_forward or restricted_head or pipeline) and unsupported:
+            logging.warning(f"⚠️ jump_forward, restricted_head e pipeline non supportano {unsupported}: uso model.generate().")
+            jump_forward = restricted_head = pipeline = False
+
+        if jump_forward or restricted_head or pipeline:
+            head = restricted_head
+            if head is True:
+                head = RestrictedHead(model, logit_processor.masks, tokenizer.eos_token_id)
+            decode_loop = _pipelined_decode_loop if pipeline else _decode_loop
+            output = decode_loop(model, tokenizer, input_ids, attention_mask, logit_processor, streamer,
+                                 max_new_tokens, do_sample, temperature, top_p,
+                                 jump_forward=jump_forward, head=head or None, past_key_values=past_key_values)
+        else:
+            if beam_search:
+                # Generate non chiama lo streamer con il beam search: i PDA dei beam sono aggiornati dal processor
+                logit_processor, streamer = BeamMaskLogitsProcessor(logit_processor, kwargs["num_beams"]), None
+                logit_processor.stats = stats
+
+            output = model.generate(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                do_sample=do_sample,
+                max_new_tokens=max_new_tokens,
+                streamer=streamer,
+                logits_processor=[logit_processor],
+                past_key_values=past_key_values,
+                **kwargs
+            )
+
+        stats.generation_seconds = time.perf_counter() - started
+        stats.requests = 1
+        stats.tokens = _count_generated(output[:, start:], tokenizer.eos_token_id)
+
+        if is_batch:
+            answer = tokenizer.batch_decode(output[:, start:], skip_special_tokens=True)
+        else:
+            answer = tokenizer.decode(output[0][start:], skip_special_tokens=True)
+
+        return (answer, stats) if return_stats else answer
 
     except Exception as e:
         raise RuntimeError(f"Errore nella generazione del testo: {e}")
+
+def _score_candidates(model, cache, prompt_mask, first_logprobs, candidates):
+    """
+    Log-probabilità (somma sui token) di ogni candidato dato il prompt, con una sola forward batch.
+    `cache` è la KV cache del prompt con una riga per candidato: la forward vi aggiunge i suffissi.
+    """
+    n = len(candidates)
+    device = first_logprobs.device
+    scores = first_logprobs[[candidate[0] for candidate in candidates]].clone()
+
+    length = max(len(candidate) for candidate in candidates)
+    if length == 1:
+        return scores
+
+    # Tutti i token tranne l'ultimo entrano nel modello (padding a destra); il token i è predetto dalla posizione i-1
+    inputs = torch.zeros((n, length - 1), dtype=torch.long, device=device)
+    targets = torch.zeros((n, length - 1), dtype=torch.long, device=device)
+    valid = torch.zeros((n, length - 1), dtype=torch.bool, device=device)
+    for row, candidate in enumerate(candidates):
+        k = len(candidate) - 1
+        if k:
+            inputs[row, :k] = torch.tensor(candidate[:-1], device=device)
+            targets[row, :k] = torch.tensor(candidate[1:], device=device)
+            valid[row, :k] = True
+
+    attention_mask = torch.cat([prompt_mask.expand(n, -1), valid.to(prompt_mask.dtype)], dim=-1)
+    logits = model(input_ids=inputs, attention_mask=attention_mask, past_key_values=cache, use_cache=True).logits
+
+    # Log-probabilità dei token obiettivo, una posizione alla volta: in float32 c'è al più un [n, vocab] per volta
+    token_logprobs = torch.empty(targets.shape, dtype=torch.float32, device=device)
+    for position in range(length - 1):
+        step_logits = logits[:, position].float()
+        token_logprobs[:, position] = (step_logits.gather(-1, targets[:, position, None]).squeeze(-1)
+                                       - torch.logsumexp(step_logits, dim=-1))
+    return scores + token_logprobs.masked_fill(~valid, 0.0).sum(dim=-1)
+
+@torch.no_grad()
+def rank_candidates(model, tokenizer, text, pars_tab, map_terminal_tokens, chat_template=None, return_distribution=False, max_candidates=10000, batch_size=64):
+    """
+    Per grammatiche con un linguaggio finito (es. classificazione gerarchica): enumera tutte le frasi
+    della grammatica e le valuta rispetto al prompt con una forward batch, invece di decodificare un token
+    alla volta. Il prompt passa nel modello una sola volta e la sua KV cache è condivisa dai candidati.
+
+    Args:
+        model: Il modello pre-addestrato.
+        tokenizer: Il tokenizer del modello.
+        text: Un singolo prompt (stringa o conversazione di create_prompt).
+        pars_tab, map_terminal_tokens: La grammatica compilata da get_parsing_table_and_map_tt().
+        return_distribution: Se True restituisce tutti i candidati con la loro probabilità.
+        max_candidates: Numero massimo di frasi da enumerare (ValueError se la grammatica ne ha di più).
+        batch_size: Candidati per forward. La forward produce logits [batch_size, lunghezza, vocabolario]:
+            None li valuta tutti insieme, solo per pochi candidati o vocabolari piccoli.
+
+    Returns:
+        Il candidato più probabile, oppure (con return_distribution=True) la lista di (testo, probabilità)
+        ordinata per probabilità decrescente, normalizzata sui candidati.
+    """
+    candidates = enumerate_sentences(pars_tab, map_terminal_tokens, max_sentences=max_candidates)
+    # Ogni candidato è valutato come output completo, quindi termina con eos (a fine frase il PDA ammette
+    # solo eos); la frase vuota, dovuta alla regola S* -> eos aggiunta in compilazione, non è un candidato
+    eos = tokenizer.eos_token_id
+    candidates = [candidate if candidate[-1] == eos else candidate + [eos] for candidate in candidates if candidate]
+    candidates = [candidate for candidate in candidates if candidate != [eos]]
+    if not candidates:
+        raise ValueError("La grammatica non genera nessuna frase.")
+
+    tokenized_input, is_batch = _tokenize_prompts(tokenizer, text, chat_template)
+    if is_batch:
+        raise ValueError("rank_candidates accetta un solo prompt.")
+    input_ids = tokenized_input["input_ids"].to(model.device)
+    attention_mask = tokenized_input["attention_mask"].to(model.device)
+
+    outputs = model(input_ids=input_ids, attention_mask=attention_mask, use_cache=True)
+    first_logprobs = torch.log_softmax(outputs.logits[0, -1].float(), dim=-1)
+
+    batch_size = min(batch_size or len(candidates), len(candidates))
+    # La KV cache del prompt è replicata una sola volta per le righe di un batch: dopo ogni batch viene
+    # riportata alla lunghezza del prompt, così i batch successivi valutano solo i suffissi dei candidati
+    prompt_length = input_ids.shape[1]
+    cache = outputs.past_key_values
+    cache.batch_repeat_interleave(batch_size)
+    scores = []
+    for i in range(0, len(candidates), batch_size):
+        batch = candidates[i:i + batch_size]
+        if len(batch) < batch_size:
+            # Ultimo batch più corto: restano solo le sue righe
+            cache.batch_select_indices(torch.arange(len(batch), device=input_ids.device))
+        scores.append(_score_candidates(model, cache, attention_mask, first_logprobs, batch))
+        suffix_length = cache.get_seq_length() - prompt_length
+        if suffix_length:
+            cache.crop(-suffix_length)
+    scores = torch.cat(scores)
+    logging.info(f"Valutati {len(candidates)} candidati in {-(-len(candidates) // batch_size)} forward batch")
+
+    texts = tokenizer.batch_decode(candidates, skip_special_tokens=True)
+    if not return_distribution:
+        return texts[int(torch.argmax(scores))]
+
+    probabilities = torch.softmax(scores, dim=-1).tolist()
+    return sorted(zip(texts, probabilities), key=lambda item: item[1], reverse=True)
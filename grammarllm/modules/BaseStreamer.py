@@ -1,4 +1,8 @@
 import logging
+import time
+
+from .DecodingStats import DecodingStats
+
 class BaseStreamer:
     #Stereamer has the functionality of updating PDA
     """
@@ -7,33 +11,42 @@ class BaseStreamer:
     def __init__(self, tokenizer, pda):
         self.tokenizer = tokenizer
         self.pda = pda
+        self.pdas = [pda]  # un PDA per ogni riga del batch
         self.is_first_call = True  # Variabile per evitare la chiamata iniziale con un tensore di più elementi.
+        self.stats = DecodingStats()  # generate_text lo condivide con il LogitProcessor della richiesta
 
     def put(self, value):
-
-        if self.pda.eos():
-            logging.info("STACK vuoto, eos generato! Interrompendo la generazione.")
-            return  # Esce dalla funzione, interrompendo l'elaborazione
-        
         """Function that is called by `.generate()` to push new tokens"""
-        generated_token_id = value[0]
-        #TO UNCOMMENT ONLY IF YOU WANT TO SEE THE ID TOKENS OF YOUR PROMPT 
-        #logging.info(f"Valore ricevuto in put: {generated_token_id}") #DEBUG
-        #logging.info(f"Valore ricevuto in put:{generated_token_id}") #DEBUG
+        #TO UNCOMMENT ONLY IF YOU WANT TO SEE THE ID TOKENS OF YOUR PROMPT
+        #logging.info(f"Valore ricevuto in put: {value}") #DEBUG
+
+        if self.is_first_call:
+            # La prima chiamata contiene il prompt
+            self.is_first_call = False
+            return
 
-        if not self.is_first_call:
+        # Un solo trasferimento per tutte le righe del batch
+        generated_token_ids = value.reshape(-1).tolist()
 
-            if generated_token_id == self.tokenizer.eos_token_id:
+        for pda, token in zip(self.pdas, generated_token_ids):
+            if pda.eos():
+                logging.info("STACK vuoto, eos generato! Interrompendo la generazione.")
+                continue
+
+            if token == self.tokenizer.eos_token_id:
                 logging.info("eos generato! Interrompendo la generazione.")
-                return
+                pda.finish()  # la riga è terminata: d'ora in poi solo eos
+                continue
+
+            start = time.perf_counter()
+            pda.next_state(token)  # Esegui il next_state del PDA
+            self.stats.transition_seconds += time.perf_counter() - start
+
 
-            token =  generated_token_id.item()
-            self.pda.next_state(token)  # Esegui il next_state del PDA
-            
-        self.is_first_call = False
-        
+    def reset(self):
+        """Prepara lo streamer per una nuova richiesta: la prossima chiamata a put() contiene il prompt."""
+        self.is_first_call = True
 
     def end(self):
         """Function that is called by `.generate()` to signal the end of generation"""
         logging.info("end generation")
-        
\ No newline at end of file
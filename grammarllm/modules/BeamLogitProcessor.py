@@ -0,0 +1,62 @@
+import time
+
+import torch
+
+from .SimpleLogitProcessor import MaskLogitsProcessor
+
+
+class BeamMaskLogitsProcessor(MaskLogitsProcessor):
+    """
+    MaskLogitsProcessor for beam search (`model.generate(num_beams=...)`), with one parser state per beam.
+
+    Generate does not call the streamer with beam search and reorders the beams at every step, so the
+    processor advances the parsers itself: at each call the parent of every beam is the beam of the
+    previous call whose sequence is the current one minus the last token; its PDA is forked in O(1)
+    (the stacks are shared, see ParserStack) and advanced with that token. A beam that picked a token
+    the grammar does not allow (possible only with a -inf score) is closed: only eos from then on.
+    """
+
+    def __init__(self, logit_processor, num_beams):
+        super().__init__(logit_processor.tokenizer, logit_processor.pda, logit_processor.masks)
+        self.num_beams = num_beams
+        self.roots = list(logit_processor.pdas)  # un PDA per prompt, nello stato iniziale
+        self.pdas = []
+        self._previous = None  # token generati dai beam alla chiamata precedente
+        self._prompt_length = None
+
+    def _beam_states(self, input_ids):
+        """PDA di ogni riga di `input_ids` ([prompt * num_beams, lunghezza]), derivati da quelli del passo precedente."""
+        if input_ids.shape[0] != len(self.roots) * self.num_beams:
+            raise ValueError(f"Il processor ha {len(self.roots)} prompt da {self.num_beams} beam "
+                             f"ma i logits hanno {input_ids.shape[0]} righe.")
+
+        if self._previous is None:
+            # Primo passo: tutti i beam partono dallo stato iniziale del proprio prompt
+            self._prompt_length = input_ids.shape[-1]
+            return [root.fork() for root in self.roots for _ in range(self.num_beams)]
+
+        # Il genitore di un beam è, tra i beam dello stesso prompt, quello con gli stessi token generati tranne l'ultimo
+        groups, length = len(self.roots), self._previous.shape[-1]
+        current = input_ids[:, self._prompt_length:-1].reshape(groups, self.num_beams, 1, length)
+        previous = self._previous.reshape(groups, 1, self.num_beams, length)
+        parents = (current == previous).all(dim=-1).int().argmax(dim=-1)
+        parents += torch.arange(groups, device=parents.device)[:, None] * self.num_beams
+
+        eos_token_id = self.tokenizer.eos_token_id
+        states = []
+        for parent, token in zip(parents.flatten().tolist(), input_ids[:, -1].tolist()):
+            pda = self.pdas[parent].fork()
+            if not pda.eos():
+                if token != eos_token_id and pda.accepts(token):
+                    pda.next_state(token)
+                else:
+                    pda.finish()
+            states.append(pda)
+        return states
+
+    def __call__(self, input_ids, scores):
+        start = time.perf_counter()
+        self.pdas = self._beam_states(input_ids)
+        self.stats.transition_seconds += time.perf_counter() - start
+        self._previous = input_ids[:, self._prompt_length:]
+        return super().__call__(input_ids, scores)
@@ -0,0 +1,39 @@
+from .BaseStreamer import BaseStreamer
+from .PushdownAutomaton import PushdownAutomaton
+from .SimpleLogitProcessor import MaskLogitsProcessor
+from .TokenMasks import TokenMasks
+
+
+class CompiledGrammar:
+    """
+    Compiled grammar shared by any number of requests: parsing table, terminal -> token map, vocabulary
+    masks, reverse index token -> terminals and allowed-token cache are built once and never copied.
+
+    Every `session()` is a new (logit_processor, streamer) pair whose PDA only owns its stack and
+    current state, so sessions are cheap to create and can decode concurrently on different threads;
+    the caches they fill lazily are shared and guarded by a lock. The grammar must not be modified
+    after construction.
+    """
+
+    def __init__(self, tokenizer, pars_tab, map_terminal_tokens, start_symbol='S*', device="cpu", cache_size=1024):
+        self.tokenizer = tokenizer
+        self.pars_tab = pars_tab
+        self.map_terminal_tokens = map_terminal_tokens
+        self.compile_times = {}  # secondi per fase di compilazione (vedi compile_grammar)
+        self.masks = TokenMasks(map_terminal_tokens, vocab_size=len(tokenizer), device=device)
+        # PDA di riferimento: le sessioni sono sue copie (spawn), con lo stack proprio e tutto il resto condiviso
+        self.pda = PushdownAutomaton(grammar=pars_tab, startSymbol=start_symbol, map=map_terminal_tokens,
+                                     masks=self.masks, cache_size=cache_size)
+
+    def new_pda(self):
+        """New parser in the start state."""
+        return self.pda.spawn()
+
+    def session(self):
+        """New (logit_processor, streamer) pair for one request, as returned by `generate_grammar_parameters`."""
+        pda = self.new_pda()
+        return MaskLogitsProcessor(self.tokenizer, pda, self.masks), BaseStreamer(self.tokenizer, pda)
+
+    def cache_info(self):
+        """Counters of the allowed-token cache shared by all the sessions."""
+        return self.pda.cache_info()
@@ -0,0 +1,117 @@
+# Descrizioni delle metriche per le righe # HELP dell'esposizione Prometheus
+HELP = {
+    "requests": "Generation requests.",
+    "steps": "Parser steps (one per batch row and generated position).",
+    "tokens": "Generated tokens, eos included.",
+    "forced_steps": "Parser steps with a single allowed token.",
+    "jump_forward_tokens": "Forced tokens appended without a forward pass.",
+    "allowed_tokens": "Sum of the sizes of the allowed token sets.",
+    "max_allowed_tokens": "Largest allowed token set.",
+    "cache_hits": "Allowed-token cache hits.",
+    "cache_misses": "Allowed-token cache misses.",
+    "allowed_set_seconds": "Seconds spent looking up the allowed tokens.",
+    "mask_build_seconds": "Seconds spent building the token masks.",
+    "mask_apply_seconds": "Seconds spent applying the masks to the logits.",
+    "transition_seconds": "Seconds spent in parser transitions.",
+    "generation_seconds": "Seconds spent generating (prefill and decoding).",
+}
+
+
+def _escape_label_value(value):
+    """Label value escaped as the Prometheus text format requires (backslash, double quote, newline)."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class DecodingStats:
+    """
+    Counters and timings of the grammar machinery for one generation, or for many once merged.
+
+    Times are host wall-clock seconds: on an accelerator the mask timings cover the launch of the
+    kernels, not their execution. `model_seconds` is what is left of the generation time after the
+    grammar work (forward passes, sampling and the rest of the loop); with `pipeline=True` the
+    grammar work overlaps the forward passes and the split is only indicative.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.steps = 0  # passi del parser (uno per riga del batch e per token da scegliere)
+        self.tokens = 0  # token generati, eos compreso
+        self.forced_steps = 0  # passi con un solo token ammesso
+        self.jump_forward_tokens = 0  # token forzati accodati senza forward (jump_forward=True)
+        self.allowed_tokens = 0  # somma delle dimensioni degli insiemi di token ammessi
+        self.max_allowed_tokens = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.allowed_set_seconds = 0.0  # terminali ammessi e maschera unita (cache del PDA)
+        self.mask_build_seconds = 0.0  # scrittura delle maschere nel buffer dei token bloccati
+        self.mask_apply_seconds = 0.0  # applicazione della maschera ai logits
+        self.transition_seconds = 0.0  # transizioni del PDA
+        self.generation_seconds = 0.0  # durata della generazione (prefill e decodifica)
+
+    @property
+    def grammar_seconds(self):
+        return self.allowed_set_seconds + self.mask_build_seconds + self.mask_apply_seconds + self.transition_seconds
+
+    @property
+    def model_seconds(self):
+        return max(self.generation_seconds - self.grammar_seconds, 0.0)
+
+    @property
+    def tokens_per_second(self):
+        return self.tokens / self.generation_seconds if self.generation_seconds else 0.0
+
+    @property
+    def cache_hit_rate(self):
+        lookups = self.cache_hits + self.cache_misses
+        return self.cache_hits / lookups if lookups else 0.0
+
+    @property
+    def mean_allowed_tokens(self):
+        return self.allowed_tokens / self.steps if self.steps else 0.0
+
+    def record_allowed(self, seconds, size, hit):
+        """One parser step: time of the allowed-set lookup, number of allowed tokens, cache hit or miss."""
+        self.allowed_set_seconds += seconds
+        self.steps += 1
+        self.allowed_tokens += size
+        if size > self.max_allowed_tokens:
+            self.max_allowed_tokens = size
+        if size == 1:
+            self.forced_steps += 1
+        if hit:
+            self.cache_hits += 1
+        else:
+            self.cache_misses += 1
+
+    def merge(self, other):
+        """Add the counters of `other` to these (e.g. to aggregate the requests served by a process)."""
+        for name, value in vars(other).items():
+            if name == "max_allowed_tokens":
+                self.max_allowed_tokens = max(self.max_allowed_tokens, value)
+            else:
+                setattr(self, name, getattr(self, name) + value)
+        return self
+
+    def as_dict(self):
+        stats = dict(vars(self))
+        for name in ("grammar_seconds", "model_seconds", "tokens_per_second", "cache_hit_rate", "mean_allowed_tokens"):
+            stats[name] = getattr(self, name)
+        return stats
+
+    def to_prometheus(self, prefix="grammarllm", labels=None):
+        """Counters in the Prometheus text exposition format, with optional `labels` ({name: value})."""
+        label_text = ",".join(f'{name}="{_escape_label_value(value)}"' for name, value in (labels or {}).items())
+        label_text = f"{{{label_text}}}" if label_text else ""
+        lines = []
+        for name, value in vars(self).items():
+            kind = "gauge" if name == "max_allowed_tokens" else "counter"
+            metric = f"{prefix}_{name}" if kind == "gauge" else f"{prefix}_{name}_total"
+            lines.append(f"# HELP {metric} {HELP[name]}")
+            lines.append(f"# TYPE {metric} {kind}")
+            lines.append(f"{metric}{label_text} {value}")
+        return "\n".join(lines) + "\n"
+
+    def __repr__(self):
+        return (f"DecodingStats(tokens={self.tokens}, tokens_per_second={self.tokens_per_second:.1f}, "
+                f"model_seconds={self.model_seconds:.4f}, grammar_seconds={self.grammar_seconds:.4f}, "
+                f"mean_allowed_tokens={self.mean_allowed_tokens:.1f}, cache_hit_rate={self.cache_hit_rate:.3f})")
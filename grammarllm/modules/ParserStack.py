@@ -0,0 +1,30 @@
+class ParserStack:
+    """
+    Immutable parser stack, stored as a linked list of nodes from the top down. The empty stack is None.
+
+    Pushing or popping a symbol gives a new stack that shares all the other nodes with the old one,
+    so copying a parser state is O(1) and the states forked from a common one (e.g. the beams of a
+    beam search) keep a single copy of the common part of their stacks.
+    """
+    __slots__ = ('top', 'rest', 'depth')
+
+    def __init__(self, top, rest=None):
+        self.top = top
+        self.rest = rest
+        self.depth = rest.depth + 1 if rest is not None else 1
+
+    def push(self, symbol):
+        return ParserStack(symbol, self)
+
+    def __len__(self):
+        return self.depth
+
+    def __iter__(self):
+        """Symbols from the top of the stack down."""
+        node = self
+        while node is not None:
+            yield node.top
+            node = node.rest
+
+    def __repr__(self):
+        return f"ParserStack({list(self)})"
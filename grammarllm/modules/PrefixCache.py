@@ -0,0 +1,91 @@
+import copy
+import logging
+import threading
+from collections import OrderedDict
+
+import torch
+
+from .PushdownAutomaton import CacheInfo
+
+
+def cache_nbytes(past_key_values):
+    """Memory used by the key/value tensors of a `past_key_values` cache."""
+    total = 0
+    for layer in past_key_values:
+        for tensor in layer[:2]:
+            if isinstance(tensor, torch.Tensor):
+                total += tensor.numel() * tensor.element_size()
+    return total
+
+
+class PrefixCache:
+    """
+    KV cache of static prompt prefixes (system prompt and few-shot examples), keyed by their token ids.
+
+    A request whose tokens start with a stored prefix reuses its `past_key_values` and only the rest
+    of the prompt (the user turn) goes through the model. Entries are evicted in LRU order when the
+    memory of the stored caches exceeds `max_bytes`. A PrefixCache belongs to a single model.
+    """
+
+    def __init__(self, max_bytes=2 * 1024 ** 3):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # tupla di token id del prefisso -> (past_key_values, byte)
+        self._nbytes = 0
+        self._stats = [0, 0]  # [hits, misses]
+        self._model_id = None
+        self._lock = threading.Lock()
+
+    def _check_model(self, model):
+        if self._model_id is None:
+            self._model_id = id(model)
+        elif self._model_id != id(model):
+            raise ValueError("Questa PrefixCache appartiene a un altro modello.")
+
+    def lookup(self, model, input_ids):
+        """
+        Longest stored prefix of `input_ids` (list of ids) that leaves at least one token to prefill.
+        Returns (prefix length, copy of its past_key_values), or (0, None) on a miss.
+        """
+        with self._lock:
+            self._check_model(model)
+            best = None
+            for key in self._entries:
+                if len(key) < len(input_ids) and (best is None or len(key) > len(best)) and tuple(input_ids[:len(key)]) == key:
+                    best = key
+            if best is None:
+                self._stats[1] += 1
+                return 0, None
+            self._stats[0] += 1
+            self._entries.move_to_end(best)
+            # La generazione estende la cache in place: ogni richiesta lavora su una copia
+            return len(best), copy.deepcopy(self._entries[best][0])
+
+    def store(self, model, prefix_ids, past_key_values):
+        """Store a copy of the `past_key_values` computed for the tokens `prefix_ids`."""
+        key = tuple(prefix_ids)
+        nbytes = cache_nbytes(past_key_values)
+        if nbytes > self.max_bytes:
+            logging.info(f"Prefisso di {len(key)} token troppo grande per la PrefixCache ({nbytes} byte)")
+            return
+        past_key_values = copy.deepcopy(past_key_values)
+        with self._lock:
+            self._check_model(model)
+            if key in self._entries:
+                self._nbytes -= self._entries.pop(key)[1]
+            self._entries[key] = (past_key_values, nbytes)
+            self._nbytes += nbytes
+            while self._nbytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._nbytes -= evicted
+        logging.info(f"Prefisso di {len(key)} token salvato nella PrefixCache ({nbytes} byte)")
+
+    def cache_info(self):
+        """Hits/misses, byte budget and bytes in use, in the style of `functools.lru_cache`."""
+        with self._lock:
+            return CacheInfo(self._stats[0], self._stats[1], self.max_bytes, self._nbytes)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+            self._stats[:] = [0, 0]
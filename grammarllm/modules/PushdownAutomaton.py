@@ -1,11 +1,24 @@
+import copy
 import logging
-class PushdownAutomaton:
-    def __init__(self,grammar,startSymbol,map):
-        self.stack = [startSymbol]
-        self.grammar = grammar
-        self.map_terminals_tokens = map
+import threading
+from collections import OrderedDict, namedtuple
+
+from .ParserStack import ParserStack
+from ..utils import diagnostics
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+class TerminalDispatch:
+    """
+    Reverse index token id -> terminals of a grammar, plus one dispatch table per distinct set of
+    allowed terminals that maps a generated token id directly to its terminal.
+    """
+    def __init__(self, map):
         self.map_tokens_terminals = {}
-        
+        self.set_ids = {}  # tupla di terminali -> id dell'insieme
+        self.terminal_sets = []  # id -> frozenset dei terminali
+        self.tables = []  # id -> {token_id: terminale}, riempita alla prima occorrenza del token
+
         for non_terminal, value in map.items():
             #print(f"Processing non-terminal: {non_terminal} {value}")  # DEBUG
             if isinstance(value, dict):
@@ -16,13 +29,72 @@ class PushdownAutomaton:
                             if token not in self.map_tokens_terminals:
                                 self.map_tokens_terminals[token] = []
                             self.map_tokens_terminals[token].append(terminal)
-            elif isinstance(value, list):
-                # Caso: valore è direttamente una lista di token
+            else:
+                # Caso: valore è direttamente una lista (o un array numpy) di token
+                if hasattr(value, 'tolist'):
+                    value = value.tolist()
                 for token in value:
                     if token not in self.map_tokens_terminals:
                         self.map_tokens_terminals[token] = []
                     self.map_tokens_terminals[token].append(non_terminal)
 
+    def set_id(self, terminals):
+        """Id of the set of allowed terminals `terminals` (registered on first use)."""
+        key = tuple(terminals)
+        set_id = self.set_ids.get(key)
+        if set_id is None:
+            set_id = len(self.tables)
+            self.set_ids[key] = set_id
+            self.terminal_sets.append(frozenset(terminals))
+            self.tables.append({})
+        return set_id
+
+    def terminal(self, set_id, token):
+        """Terminal matched by `token` among the terminals of the set `set_id`."""
+        table = self.tables[set_id]
+        terminal = table.get(token)
+        if terminal is None:
+            allowed = self.terminal_sets[set_id]
+            check_terminals = [t for t in self.map_tokens_terminals.get(token, ()) if t in allowed]
+            if diagnostics.DEBUG:
+                logging.info(f"check_terminals is: {check_terminals}")
+            assert len(check_terminals) == 1, "Scelto un token ambiguo, in quanto corrispondente a più possibili terminali per questo stato"
+            terminal = table[token] = check_terminals[0]
+        return terminal
+
+class PushdownAutomaton:
+    def __init__(self,grammar,startSymbol,map,masks=None,cache_size=1024,dispatch=None):
+        self.start_symbol = startSymbol
+        self.stack = ParserStack(startSymbol)  # stack immutabile: fork() e i probe non lo copiano
+        self.grammar = grammar
+        self.map_terminals_tokens = map
+        self.masks = masks  # TokenMasks opzionali per costruire la maschera dei token ammessi
+
+        # FIRST dei non terminali conservati nella tabella di parsing (vedi ParsingTable)
+        first_sets = getattr(grammar, 'first_sets', None)
+        self.nullable = getattr(grammar, 'nullable', set())
+        self.first_terminals = None
+        if first_sets:
+            # Terminali di FIRST(nt) - {ε}, nell'ordine della riga della tabella
+            self.first_terminals = {
+                nt: tuple(t for t in rules if t in first_sets.get(nt, ()))
+                for nt, rules in grammar.items()
+            }
+
+        # Cache LRU: firma dello stack -> (terminali ammessi, maschera unita, id dell'insieme di terminali,
+        # unico token ammesso o None)
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._cache_stats = [0, 0]  # [hits, misses], condivisi con i PDA creati da spawn()
+        self._lock = threading.Lock()  # cache e dispatch sono condivisi da spawn()/fork(), anche tra thread
+        
+        # Indice inverso token -> terminali e tabelle di dispatch, costruiti una volta e condivisi da spawn()
+        self.dispatch = dispatch if dispatch is not None else TerminalDispatch(map)
+        self.map_tokens_terminals = self.dispatch.map_tokens_terminals
+        self.current_set_id = None
+        self.current_forced = None
+        self.last_cache_hit = None  # esito dell'ultima ricerca nella cache (per DecodingStats)
+
 
     def recursive_get_tokens(self, stack, visited=None):
         if visited is None:
@@ -52,8 +124,155 @@ class PushdownAutomaton:
 
         return tokens
 
+    def get_terminals(self):
+        """Terminals that can be generated from the current state."""
+        return self.get_terminals_and_mask()[0]
+
+    def stack_signature(self):
+        """
+        Part of the stack that decides the next-token set, from the top down to the first
+        non-nullable symbol. Without FIRST sets only the top symbol is expanded.
+        """
+        if self.first_terminals is None:
+            return (self.stack.top,) if self.stack is not None else ()
+
+        signature = []
+        for symbol in self.stack or ():
+            signature.append(symbol)
+            if symbol not in self.nullable:
+                break
+        return tuple(signature)
+
+    def terminals_for_signature(self, signature):
+        """Legal terminals for a stack whose topmost symbols are `signature` (top first)."""
+        if self.first_terminals is None:
+            return self.recursive_get_tokens(list(reversed(signature)))
+
+        terminals = {}
+        for symbol in signature:
+            if symbol in self.first_terminals:
+                terminals.update(dict.fromkeys(self.first_terminals[symbol]))
+            else:
+                terminals[symbol] = None
+        return list(terminals)
+
+    def get_terminals_and_mask(self):
+        """
+        Terminals that can be generated from the current state, the union of their token masks
+        and the number of allowed tokens, served from an LRU cache keyed by `stack_signature()`.
+        """
+        key = self.stack_signature()
+        with self._lock:
+            entry = self._cache.get(key)
+            self.last_cache_hit = entry is not None
+            if entry is not None:
+                self._cache_stats[0] += 1
+                self._cache.move_to_end(key)
+            else:
+                self._cache_stats[1] += 1
+                entry = self._cache[key] = self._compute_entry(key)
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+        self.current_terminals = entry[0]
+        self.current_set_id = entry[2]
+        self.current_forced = entry[3]
+        return entry[0], entry[1], entry[4]
+
+    def _compute_entry(self, signature):
+        """
+        Cache entry of a stack signature:
+        (terminals, mask, terminal set id, only allowed token or None, number of allowed tokens).
+        """
+        terminals = self.terminals_for_signature(signature)
+        mask = None
+        forced = None
+        expected = 0
+        if self.masks is not None:
+            mask = self.masks.merge(terminals)
+            expected = sum(self.masks.counts[terminal] for terminal in terminals)
+            assert int(mask.sum()) == expected, "I token associati ai terminali non sono disgiunti"
+            if expected == 1:
+                # Un solo token ammesso: lo stato è forzato (vedi forced_tokens)
+                forced = next(int(self.masks.ids(t)[0]) for t in terminals if self.masks.counts[t])
+        return terminals, mask, self.dispatch.set_id(terminals), forced, expected
+
+    def forced_token(self):
+        """Id of the only token allowed in the current state, or None if more than one token is allowed."""
+        if not self.stack:
+            return None
+        self.get_terminals_and_mask()
+        return self.current_forced
+
+    def forced_tokens(self, max_tokens=None):
+        """
+        Maximal run of forced tokens from the current state (states that allow exactly one token),
+        computed on a fork: the state of this PDA does not change.
+        """
+        probe = self.fork()
+        run = []
+        while max_tokens is None or len(run) < max_tokens:
+            token = probe.forced_token()
+            if token is None:
+                break
+            run.append(token)
+            probe.next_state(token)
+        return run
+
+    def cache_info(self):
+        """Hit/miss counters of the allowed-token cache, in the style of `functools.lru_cache`."""
+        hits, misses = self._cache_stats
+        return CacheInfo(hits, misses, self.cache_size, len(self._cache))
+
+    def cache_clear(self):
+        with self._lock:
+            self._cache.clear()
+            self._cache_stats[:] = [0, 0]
+
+    def to(self, device):
+        """Move the (shared) masks to `device`; the cached masks, on the previous device, are dropped."""
+        with self._lock:
+            if self.masks.device != device:
+                self.masks.to(device)
+                self._cache.clear()
+        return self
+
+    def spawn(self):
+        """
+        New PDA in the start state that shares the grammar, the token maps, the masks and
+        the allowed-token cache with this one (e.g. one parser per row of a batch).
+        """
+        return copy.copy(self).reset()
+
+    def reset(self):
+        """Back to the start state, for a new request."""
+        self.stack = ParserStack(self.start_symbol)
+        self.current_terminals = []
+        self.current_set_id = None
+        self.current_forced = None
+        return self
+
+    def fork(self):
+        """
+        Copy of this PDA in its current state, in O(1): the stack is immutable (see ParserStack) and is
+        shared until one of the two copies advances. Grammar, masks and caches are shared as in spawn().
+        """
+        return copy.copy(self)
+
+    def accepts(self, token):
+        """True if `token` matches one of the terminals allowed in the current state."""
+        if self.current_set_id is None:
+            self.get_terminals_and_mask()
+        allowed = self.dispatch.terminal_sets[self.current_set_id]
+        return any(terminal in allowed for terminal in self.map_tokens_terminals.get(token, ()))
+
+    def finish(self):
+        """Mark the parse as complete (eos generated): only eos is allowed from now on."""
+        self.stack = None
+        self.current_set_id = None
+
     def get_tokens(self):
-        terminals = self.recursive_get_tokens(self.stack.copy())
+        terminals = self.get_terminals()
         tokens = set()
     
         for terminal in terminals:
@@ -68,40 +287,38 @@ class PushdownAutomaton:
         return list(tokens)
     
     def next_state(self, token_gen):
-        logging.info(f"current terminals is:{self.current_terminals}")
-        check_terminals = set(self.map_tokens_terminals[token_gen]).intersection(set(self.current_terminals))
-        logging.info(f"check_terminals is: {check_terminals}")
-
+        if self.current_set_id is None:
+            self.get_terminals_and_mask()
+        if diagnostics.DEBUG:
+            logging.info(f"current terminals is:{self.current_terminals}")
 
-        assert len(check_terminals) == 1, "Scelto un token ambiguo, in quanto corrispondente a più possibili terminali per questo stato"
-        terminal = list(check_terminals)[0]
+        terminal = self.dispatch.terminal(self.current_set_id, token_gen)
+        self.current_set_id = None  # lo stato cambia: l'insieme va ricalcolato
         self.next_state_terminal(terminal)
 
 
     def next_state_terminal(self, terminal):
         token = terminal
         stack = self.stack
-        top = stack.pop()
-        
+        top, stack = stack.top, stack.rest
+
         # Se il top dello stack è una regola (non terminale), espanderla prima di confrontare
-        if top in self.grammar:
-            # Espande la regola e mette i simboli della produzione nello stack
+        while top in self.grammar:
+            # Espande la regola e mette i simboli della produzione nello stack (nuovi nodi, la coda è condivisa)
             #print(f"Espando: top={top}, terminal={token}") #DEBUG
             #print(f"Chiavi disponibili per '{top}': {list(self.grammar[top].keys())}") #DEBUG
-            
+
             for symbol in reversed(self.grammar[top][token]):
-                stack.append(symbol)
+                stack = ParserStack(symbol, stack)
+            top, stack = stack.top, stack.rest
 
-            # Richiama ricorsivamente per gestire il terminale
-            self.next_state_terminal(token)
-            return
-        
         if not top == token:
             # Ora il top dello stack deve essere un terminale
-            print("Parser Stack:", stack)
+            print("Parser Stack:", list(stack or ()))
             print("Comparing:", top, "vs", token)
             print(top == token, f"Errore: trovato '{top}', atteso '{token}'")
         assert top == token, f"Errore: trovato '{top}', atteso '{token}'"
-        
+        self.stack = stack
+
     def eos(self):
         return True if not self.stack else False
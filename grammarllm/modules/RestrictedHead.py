@@ -0,0 +1,97 @@
+import logging
+import weakref
+
+import torch
+
+
+class RestrictedHead:
+    """
+    Output projection (lm_head) restricted to the tokens the grammar allows.
+
+    The base model produces the last hidden state and the head is applied only to the rows of the
+    allowed tokens: for small allowed sets the rows are gathered at every step, otherwise a reduced
+    head with the rows of all the tokens that appear in some terminal of the grammar (plus eos),
+    built on first use, is used. If those tokens are more than `max_reduced_fraction` of the
+    vocabulary the reduced head would duplicate most of lm_head for little gain, so the full head
+    is used instead. The result is a full-vocabulary row of logits with -inf everywhere else,
+    so the logits processor and the sampling work unchanged.
+    """
+
+    def __init__(self, model, masks, eos_token_id, max_gather=1024, max_reduced_fraction=0.25):
+        head = model.get_output_embeddings()
+        self.base = getattr(model, model.base_model_prefix)
+        self.weight = head.weight
+        self.bias = getattr(head, "bias", None)
+        self.softcap = getattr(model.config, "final_logit_softcapping", None)
+        self.vocab_size = self.weight.shape[0]
+        self.eos_token_id = eos_token_id
+        self.max_gather = max_gather  # oltre questa dimensione si usa la testa ridotta della grammatica
+
+        device = self.weight.device
+        ids = [masks.ids(terminal).to(device) for terminal in masks.terminal_ids]
+        ids.append(torch.tensor([eos_token_id], device=device))
+        grammar_ids = torch.unique(torch.cat(ids))
+        grammar_ids = grammar_ids[grammar_ids < self.vocab_size]
+        # None: la grammatica copre gran parte del vocabolario e per gli insiemi grandi si usa la testa completa
+        self.grammar_ids = grammar_ids if grammar_ids.numel() <= max_reduced_fraction * self.vocab_size else None
+        self._grammar_head = None  # (pesi, bias) della testa ridotta, copiati alla prima forward che li usa
+        self.eos_ids = torch.tensor([eos_token_id], device=device)
+
+        # dispatch -> {id dell'insieme di terminali: token ammessi, None se nessun filtro}; chiavi deboli:
+        # l'id di un dispatch liberato può essere riusato da un'altra grammatica
+        self._allowed_ids = weakref.WeakKeyDictionary()
+        if self.grammar_ids is None:
+            logging.info(f"La grammatica usa {grammar_ids.numel()} token su {self.vocab_size}: nessuna testa ridotta")
+        else:
+            logging.info(f"Testa ridotta della grammatica: {self.grammar_ids.numel()} token su {self.vocab_size}")
+
+    def forward(self, **kwargs):
+        """Run the base model: returns the hidden state of the last position and the KV cache."""
+        outputs = self.base(**kwargs)
+        return outputs.last_hidden_state[:, -1], outputs.past_key_values
+
+    def allowed_ids(self, pda):
+        """Token ids allowed in the current state of `pda` (None: no restriction)."""
+        if pda.eos():
+            return self.eos_ids
+        _, mask, size = pda.get_terminals_and_mask()
+        allowed_ids = self._allowed_ids.setdefault(pda.dispatch, {})
+        if pda.current_set_id not in allowed_ids:
+            if mask is None or not size:
+                ids = None
+            else:
+                ids = mask.nonzero().flatten().to(self.weight.device)
+                ids = ids[ids < self.vocab_size]
+            allowed_ids[pda.current_set_id] = ids
+        return allowed_ids[pda.current_set_id]
+
+    def _reduced_head(self):
+        """Pesi e bias delle righe di grammar_ids, copiati una sola volta."""
+        if self._grammar_head is None:
+            bias = self.bias.index_select(0, self.grammar_ids) if self.bias is not None else None
+            self._grammar_head = (self.weight.index_select(0, self.grammar_ids), bias)
+        return self._grammar_head
+
+    def _project(self, hidden, weight, bias):
+        logits = torch.nn.functional.linear(hidden, weight, bias)
+        if self.softcap is not None:
+            logits = torch.tanh(logits / self.softcap) * self.softcap
+        return logits.float()
+
+    def logits(self, hidden, pda):
+        """Full-vocabulary logits for `hidden` ([1, hidden_size]), computed only for the allowed tokens."""
+        ids = self.allowed_ids(pda)
+        if ids is None or (ids.numel() > self.max_gather and self.grammar_ids is None):
+            # Il processor dei logits maschera comunque i token non ammessi
+            return self._project(hidden, self.weight, self.bias)
+
+        if ids.numel() <= self.max_gather:
+            weight = self.weight.index_select(0, ids)
+            bias = self.bias.index_select(0, ids) if self.bias is not None else None
+        else:
+            ids = self.grammar_ids
+            weight, bias = self._reduced_head()
+
+        scores = torch.full((hidden.shape[0], self.vocab_size), -float("inf"), device=hidden.device)
+        scores[:, ids] = self._project(hidden, weight, bias)
+        return scores
@@ -1,15 +1,30 @@
-
 import logging
+import time
 from transformers import LogitsProcessor
 import torch
 
+from .TokenMasks import TokenMasks
+from .DecodingStats import DecodingStats
+from ..utils import diagnostics
+
 class MaskLogitsProcessor(LogitsProcessor):
-    def __init__(self, tokenizer, pda):
+    def __init__(self, tokenizer, pda, masks=None):
         self.tokenizer = tokenizer
         self.pda = pda
+        self.pdas = [pda]  # un PDA per ogni riga del batch
+        # Maschere precompilate per terminale, costruite una sola volta dal map_terminal_tokens
+        if masks is None:
+            masks = pda.masks if pda.masks is not None else TokenMasks(pda.map_terminals_tokens, len(tokenizer))
+        self.masks = masks
+        self.pda.masks = masks
+        self._eos_allowed = None  # maschera [vocab_size] con il solo eos
+        self._blocked = None  # buffer [scores.shape[-1]] dei token da mascherare
+        self._prepared = None  # maschere delle righe già calcolate da prepare(), usate dalla prossima chiamata
+        self.stats = DecodingStats()  # contatori e tempi della grammatica (generate_text ne crea uno per richiesta)
+        self._step = 0  # passi di decodifica, per campionare le tracce dei top-10 (diagnostics.TRACE_EVERY)
 
     def log_top_10_scores(self, filtered_probabilities, prefix):
-        top_probs, top_indices = torch.topk(filtered_probabilities, 10, dim=1)
+        top_probs, top_indices = torch.topk(filtered_probabilities, min(10, filtered_probabilities.shape[-1]), dim=1)
         top_token_ids = top_indices[0].tolist()
         top_probs = top_probs[0].tolist()
         top_token_labels = self.tokenizer.convert_ids_to_tokens(top_token_ids)
@@ -17,51 +32,110 @@ class MaskLogitsProcessor(LogitsProcessor):
         log_message = f"{prefix}:\nTop 10 Tokens!!!\n"
         for token, prob in zip(top_token_labels, top_probs):
             log_message += f"Token: {token}, Probability: {prob:.6f}\n"
-            
+
         logging.info(log_message)
 
+    def _prepare_buffers(self, shape, device):
+        """Alloca (una sola volta) i buffer delle maschere sulla device dei logits."""
+        shape = torch.Size(shape)
+        if self._blocked is None or self._blocked.device != device or self._blocked.shape != shape:
+            self._eos_allowed = torch.zeros(shape[-1], dtype=torch.bool, device=device)
+            self._eos_allowed[self.tokenizer.eos_token_id] = True
+            self._blocked = torch.ones(shape, dtype=torch.bool, device=device)
+
+    def _fill_blocked(self, row, allowed):
+        """Scrive nella riga `row` del buffer i token da mascherare (nessuno se `allowed` è None)."""
+        blocked = self._blocked[row]
+        if allowed is None:
+            blocked.fill_(False)
+            return
+        n = min(allowed.shape[-1], blocked.shape[-1])
+        torch.logical_not(allowed[:n], out=blocked[:n])
+        if n < blocked.shape[-1]:
+            blocked[n:] = True
+
+    def _row_allowed(self, pda, device):
+        """
+        Maschera dei token ammessi dal PDA di una riga del batch (None: nessun filtro).
+        Ogni PDA usa le maschere della propria grammatica, quindi le righe possono avere grammatiche diverse.
+        """
+        if diagnostics.DEBUG:
+            logging.info(f"Stack: {list(pda.stack or ())}")
+
+        if pda.masks.device != device:
+            pda.to(device)  # le maschere in cache sono sulla device precedente
+
+        start = time.perf_counter()
+        terminals, allowed, size = pda.get_terminals_and_mask()
+        if not pda.eos():
+            self.stats.record_allowed(time.perf_counter() - start, size, pda.last_cache_hit)
+        if size:
+            return allowed
+
+        if diagnostics.DEBUG:
+            logging.info(f"Valid tokens è vuoto!{terminals}")
+        if pda.eos():
+            if diagnostics.DEBUG:
+                logging.info("stack vuoto quindi eos True")
+                logging.info("\n\nposso generare solo eos perché stack vuoto!")
+            return self._eos_allowed
+
+        if diagnostics.DEBUG:
+            logging.info("Valid tokens è vuoto e eos() è False, nessun filtro applicato.")
+        return None
+
+    def _compute_blocked(self, shape, device):
+        """Maschere delle righe del batch per lo stato corrente dei PDA, scritte nel buffer dei token bloccati."""
+        self._prepare_buffers(shape, device)
+        rows_allowed = [self._row_allowed(pda, device) for pda in self.pdas]
+        if any(allowed is not None for allowed in rows_allowed):
+            start = time.perf_counter()
+            for row, allowed in enumerate(rows_allowed):
+                self._fill_blocked(row, allowed)
+            self.stats.mask_build_seconds += time.perf_counter() - start
+        return rows_allowed
+
+    def prepare(self, shape, device):
+        """
+        Calcola in anticipo (es. su un thread mentre il modello esegue la forward) le maschere dello stato
+        corrente dei PDA: la prossima chiamata, con logits di forma `shape`, le usa senza interrogare i PDA.
+        Lo stato dei PDA non deve cambiare prima di quella chiamata.
+        """
+        self._prepared = (torch.Size(shape), torch.device(device), self._compute_blocked(shape, device))
+
+    def reset(self):
+        """Riporta i PDA allo stato iniziale, per una nuova richiesta."""
+        for pda in self.pdas:
+            pda.reset()
+        self._prepared = None
+        self._step = 0
+
     def __call__(self, input_ids, scores):
-        logging.info(f"Stack: {self.pda.stack[::-1]}") 
-        
-        valid_tokens = self.pda.get_tokens()
-        valid_tokens_ids = valid_tokens
+        if len(self.pdas) != scores.shape[0]:
+            raise ValueError(f"Il processor ha {len(self.pdas)} PDA ma i logits hanno {scores.shape[0]} righe.")
 
-        if valid_tokens_ids:
-            logging.info("\n\nLogitsProcessor attivato!")  
+        prepared, self._prepared = self._prepared, None
+        if prepared is not None and prepared[0] == scores.shape and prepared[1] == scores.device:
+            rows_allowed = prepared[2]
+        else:
+            rows_allowed = self._compute_blocked(scores.shape, scores.device)
+        if all(allowed is None for allowed in rows_allowed):
+            return scores
+
+        # Traccia dei top-10 solo in modalità debug e solo un passo ogni TRACE_EVERY
+        trace = diagnostics.DEBUG and diagnostics.TRACE_EVERY and self._step % diagnostics.TRACE_EVERY == 0
+        self._step += 1
+        if trace:
+            logging.info("\n\nLogitsProcessor attivato!")
             original_probabilities = torch.softmax(scores, dim=-1)
             self.log_top_10_scores(original_probabilities, prefix="Original")
 
-            filtered_scores = scores.clone()
+        start = time.perf_counter()
+        filtered_scores = scores.masked_fill_(self._blocked, -float('inf'))
+        self.stats.mask_apply_seconds += time.perf_counter() - start
 
-            filtered_scores = torch.full_like(scores, -float('inf'))
-            filtered_scores[:, valid_tokens_ids] = scores[:, valid_tokens_ids]
+        if trace:
             filtered_probabilities = torch.softmax(filtered_scores, dim=-1)
-
-
             self.log_top_10_scores(filtered_probabilities, prefix="Filtered")
 
-            return filtered_scores
-
-        else:
-            logging.info(f"Valid tokens è vuoto!{valid_tokens}")
-            if self.pda.eos():
-                logging.info("stack vuoto quindi eos True")
-                valid_tokens_ids = [self.tokenizer.eos_token_id]
-
-                logging.info("\n\nposso generare solo eos perché stack vuoto!")
-                logging.info("LogitsProcessor attivato!")  
-                original_probabilities = torch.softmax(scores, dim=-1)
-                self.log_top_10_scores(original_probabilities, prefix="Original")
-
-                # # Applica la stessa logica per EOS
-                filtered_scores = scores.clone()
-                filtered_scores = torch.full_like(scores, -float('inf'))
-                filtered_scores[:, valid_tokens_ids] = scores[:, valid_tokens_ids]
-
-                filtered_probabilities = torch.softmax(filtered_scores, dim=-1)
-                self.log_top_10_scores(filtered_probabilities, prefix="Filtered")
-
-                return filtered_scores
-            else:
-                logging.info("Valid tokens è vuoto e eos() è False, nessun filtro applicato.")
-                return scores
\ No newline at end of file
+        return filtered_scores
@@ -0,0 +1,47 @@
+import torch
+
+
+class TokenMasks:
+    """
+    Precompiled vocabulary masks for the terminals of a grammar.
+
+    The token ids of every terminal are converted once into a tensor, so that
+    at decoding time the allowed set of a parser state is obtained by OR-ing
+    the cached tensors into a preallocated boolean buffer, without building
+    Python lists or converting them to tensors at every step.
+    """
+
+    def __init__(self, map_terminal_tokens, vocab_size, device="cpu"):
+        self.vocab_size = vocab_size
+        self.device = torch.device(device)
+        self.terminal_ids = {}
+        self.counts = {}
+
+        for terminal, tokens in map_terminal_tokens.items():
+            ids = torch.as_tensor(tokens, dtype=torch.long).flatten()
+            self.terminal_ids[terminal] = ids.to(self.device)
+            self.counts[terminal] = ids.numel()
+
+    def to(self, device):
+        """Move the cached tensors on `device` (no-op if they are already there)."""
+        device = torch.device(device)
+        if device != self.device:
+            self.terminal_ids = {t: ids.to(device) for t, ids in self.terminal_ids.items()}
+            self.device = device
+        return self
+
+    def ids(self, terminal):
+        """Tensor of the token ids associated to `terminal`."""
+        return self.terminal_ids[terminal]
+
+    def fill(self, terminals, out):
+        """Write in `out` (bool tensor of size `vocab_size`) the union of the masks of `terminals`."""
+        out.fill_(False)
+        for terminal in terminals:
+            out.index_fill_(0, self.terminal_ids[terminal], True)
+        return out
+
+    def merge(self, terminals):
+        """Return a new boolean mask with the union of the masks of `terminals`."""
+        out = torch.empty(self.vocab_size, dtype=torch.bool, device=self.device)
+        return self.fill(terminals, out)
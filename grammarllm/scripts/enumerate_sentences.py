@@ -0,0 +1,55 @@
+from .generate_LL1_parsing_table import compute_first_of_string
+
+
+def enumerate_sentences(pars_tab, map_terminal_tokens, start_symbol='S*', max_sentences=10000, max_length=512):
+    """
+    Enumera tutte le frasi (sequenze di token id) del linguaggio di una grammatica finita, a partire
+    dalla tabella di parsing compilata. Le frasi sono prodotte in profondità, quindi quelle con un
+    prefisso comune sono consecutive.
+
+    Solleva ValueError se le frasi sono più di `max_sentences` o più lunghe di `max_length` token
+    (es. grammatiche ricorsive, il cui linguaggio è infinito).
+    """
+    # Regole distinte di ogni non terminale: nella tabella la stessa regola compare una volta per
+    # ogni terminale del suo FIRST (e [] per ogni terminale del FOLLOW)
+    # Le regole ε dei non terminali seguiti solo da fine input ('$' viene tolto dalla tabella) non
+    # compaiono in nessuna riga: per i non terminali annullabili senza una regola ε si aggiunge []
+    first_sets = getattr(pars_tab, 'first_sets', {})
+    rules = {}
+    for nt, row in pars_tab.items():
+        distinct = {}
+        for rule in row.values():
+            distinct.setdefault(tuple(rule), rule)
+        if nt in getattr(pars_tab, 'nullable', ()) and not any(
+                'ε' in compute_first_of_string(rule, first_sets) for rule in distinct.values()):
+            distinct[()] = []
+        rules[nt] = list(distinct.values())
+
+    sentences = []
+    # Ogni elemento: (stack dei simboli ancora da espandere, con il top in fondo; token già prodotti)
+    worklist = [((start_symbol,), ())]
+    while worklist:
+        stack, prefix = worklist.pop()
+        if not stack:
+            sentences.append(list(prefix))
+            if len(sentences) > max_sentences:
+                raise ValueError(f"La grammatica ha più di {max_sentences} frasi: impossibile enumerarle tutte.")
+            continue
+        if len(prefix) > max_length or len(stack) > max_length:
+            raise ValueError(f"Frase più lunga di {max_length} token: la grammatica non è finita?")
+
+        top, rest = stack[-1], stack[:-1]
+        if top == 'ε':
+            worklist.append((rest, prefix))
+        elif top in rules:
+            # In ordine inverso, così la prima regola viene espansa per prima
+            for rule in reversed(rules[top]):
+                worklist.append((rest + tuple(reversed(rule)), prefix))
+        else:
+            tokens = map_terminal_tokens.get(top, [])
+            if hasattr(tokens, 'tolist'):
+                tokens = tokens.tolist()
+            for token in reversed(tokens):
+                worklist.append((rest, prefix + (int(token),)))
+
+    return sentences
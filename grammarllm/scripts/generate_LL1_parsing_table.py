@@ -1,7 +1,17 @@
 import os, json, logging
-from collections import defaultdict
+from collections import defaultdict, deque
 from copy import deepcopy
 
+class ParsingTable(dict):
+    """
+    Tabella di parsing LL(1) (non terminale -> {terminale: regola}) che conserva anche
+    i FIRST dei non terminali, usati dal PDA per calcolare i terminali ammessi.
+    """
+    def __init__(self, table, first_sets=None):
+        super().__init__(table)
+        self.first_sets = first_sets or {}
+        self.nullable = {nt for nt, first in self.first_sets.items() if 'ε' in first}
+
 def compute_first_of_string(symbols, first_sets):
     """Calcola FIRST per una sequenza di simboli (es. corpo di una produzione)."""
     first_result = set()
@@ -20,74 +30,122 @@ def compute_first_of_string(symbols, first_sets):
 
     return first_result
 
-def find_first(symbol, productions, first_sets):
-    def calculate_first_of_sequence(symbols, productions, first_sets):
-        """Calcola i FIRST di una sequenza di simboli."""
-        if not symbols:
-            return {"ε"}
-        #print(f"Calculating FIRST sequence: {symbols}...") #DEBUG
-
-        first_symbol = symbols[0]
-        
-
-        if first_symbol in productions:
-            if first_symbol not in first_sets:
-                find_first(first_symbol, productions, first_sets)
-
-            result = first_sets[first_symbol].copy() - {"ε"}
-
-            if "ε" in first_sets[first_symbol]:
-                rest_first = calculate_first_of_sequence(symbols[1:], productions, first_sets)
-                result |= rest_first
-
-            return result
-        else:
-            return {first_symbol}
-
-    if symbol in first_sets:
-        return first_sets[symbol]
-
-    if symbol in productions:
-        first_sets[symbol] = set()
-
-        for production in productions[symbol]:
-            if production == ['ε']:
-                first_sets[symbol].add("ε")
-            else:
-                first_of_sequence = calculate_first_of_sequence(production, productions, first_sets)
-                first_sets[symbol] |= first_of_sequence
-
-        return first_sets[symbol]
-    else:
-        return {symbol}
+def compute_nullable(productions):
+    """
+    Non terminali annullabili (che derivano ε), con una worklist: ogni regola tiene il numero
+    di simboli non ancora noti come annullabili e viene rivisitata solo quando uno di essi lo diventa.
+    """
+    nullable = set()
+    worklist = []
+    remaining = {}  # (lhs, indice regola) -> simboli della regola non ancora annullabili
+    occurrences = defaultdict(list)  # non terminale -> regole in cui compare
+
+    for lhs, rules in productions.items():
+        for i, rule in enumerate(rules):
+            symbols = [symbol for symbol in rule if symbol != 'ε']
+            if not symbols:
+                if lhs not in nullable:
+                    nullable.add(lhs)
+                    worklist.append(lhs)
+            elif all(symbol in productions for symbol in symbols):
+                # Una regola con un terminale non potrà mai essere annullabile
+                remaining[(lhs, i)] = len(symbols)
+                for symbol in symbols:
+                    occurrences[symbol].append((lhs, i))
+
+    while worklist:
+        symbol = worklist.pop()
+        for key in occurrences[symbol]:
+            remaining[key] -= 1
+            lhs = key[0]
+            if remaining[key] == 0 and lhs not in nullable:
+                nullable.add(lhs)
+                worklist.append(lhs)
+
+    return nullable
+
+def _propagate(sets, edges, worklist):
+    """
+    Propaga gli insiemi lungo gli archi `edges` (sorgente -> destinazioni, sets[dest] ⊇ sets[sorgente])
+    finché non cambia più nulla. Lungo ogni arco viaggiano solo gli elementi nuovi (delta).
+    """
+    pending = {symbol: set(sets[symbol]) for symbol in worklist}
+    queue = deque(pending)
+    while queue:
+        source = queue.popleft()
+        delta = pending.pop(source)
+        for target in edges.get(source, ()):
+            new = delta - sets[target]
+            if new:
+                sets[target] |= new
+                if target in pending:
+                    pending[target] |= new
+                else:
+                    pending[target] = new
+                    queue.append(target)
+
+def compute_first_sets(productions, nullable=None):
+    """
+    FIRST di tutti i non terminali (con 'ε' per quelli annullabili), calcolati con un grafo delle
+    dipendenze FIRST(A) ⊇ FIRST(B) e una worklist che rivisita solo i simboli interessati da una modifica.
+    """
+    if nullable is None:
+        nullable = compute_nullable(productions)
+
+    first_sets = {nt: set() for nt in productions}
+    edges = defaultdict(set)  # B -> {A : FIRST(A) ⊇ FIRST(B)}
+    for lhs, rules in productions.items():
+        for rule in rules:
+            for symbol in rule:
+                if symbol == 'ε':
+                    continue
+                if symbol in productions:
+                    edges[symbol].add(lhs)
+                    if symbol not in nullable:
+                        break
+                else:
+                    first_sets[lhs].add(symbol)
+                    break
+
+    _propagate(first_sets, edges, [nt for nt, first in first_sets.items() if first])
+
+    for nt in nullable:
+        first_sets[nt].add('ε')
+    return first_sets
 
 def follow(productions, first_sets, start_symbol):
+    """
+    FOLLOW di tutti i non terminali. Ogni regola viene letta una sola volta da destra a sinistra,
+    accumulando il FIRST del suffisso; i vincoli FOLLOW(B) ⊇ FOLLOW(A) diventano archi del grafo
+    propagato con la worklist.
+    """
     follow_sets = {nt: set() for nt in productions}
     follow_sets[start_symbol].add("$")
-
-    changed = True
-    while changed:
-        changed = False
-        for lhs, rhs_list in productions.items():
-            for rhs in rhs_list:
-                for i, symbol in enumerate(rhs):
-                    if symbol in productions:  # Non terminale
-                        old_size = len(follow_sets[symbol])
-
-                        # Case 1: simbolo seguito da altri simboli
-                        if i + 1 < len(rhs):
-                            next_symbols = rhs[i+1:]
-                            first_of_next = compute_first_of_string(next_symbols, first_sets)
-                            follow_sets[symbol] |= first_of_next - {"ε"}
-                            if "ε" in first_of_next:
-                                follow_sets[symbol] |= follow_sets[lhs]
-                        else:
-                            # Case 2: simbolo alla fine → eredita follow(lhs)
-                            follow_sets[symbol] |= follow_sets[lhs]
-
-                        if len(follow_sets[symbol]) > old_size:
-                            changed = True
-
+    edges = defaultdict(set)  # A -> {B : FOLLOW(B) ⊇ FOLLOW(A)}
+    first_no_eps = {nt: first - {'ε'} for nt, first in first_sets.items()}
+
+    for lhs, rhs_list in productions.items():
+        for rhs in rhs_list:
+            suffix_first = set()  # FIRST del suffisso a destra del simbolo corrente, senza ε
+            suffix_nullable = True
+            for symbol in reversed(rhs):
+                if symbol == 'ε':
+                    continue
+                if symbol in productions:  # Non terminale
+                    follow_sets[symbol] |= suffix_first
+                    if suffix_nullable:
+                        # Case 2: simbolo alla fine (o seguito da simboli annullabili) → eredita follow(lhs)
+                        edges[lhs].add(symbol)
+                    if 'ε' in first_sets[symbol]:
+                        suffix_first = suffix_first | first_no_eps[symbol]
+                    else:
+                        suffix_first = first_no_eps[symbol]
+                        suffix_nullable = False
+                else:
+                    suffix_first = {symbol}
+                    suffix_nullable = False
+
+    _propagate(follow_sets, edges, [nt for nt, follow_set in follow_sets.items() if follow_set])
     return follow_sets
 
 def parsing_table(final_rules):
@@ -137,9 +195,7 @@ def parsing_table(final_rules):
     logging.info(final_rules)
 
     # Calcola FIRST e FOLLOW
-    first_sets = {}
-    for nt in grammar:
-        find_first(nt, grammar, first_sets)
+    first_sets = compute_first_sets(grammar)
 
     logging.info("\nFirst sets:\n")
     logging.info(first_sets)
@@ -153,4 +209,4 @@ def parsing_table(final_rules):
     table = compute_parsing_table(grammar, first_sets, follow_sets)
     save_table_parsing_as_txt(table)
 
-    return table
+    return ParsingTable(table, first_sets=first_sets)
@@ -0,0 +1,134 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import uuid
+import weakref
+
+import numpy as np
+
+from .generate_LL1_parsing_table import ParsingTable
+
+# Incrementare quando cambia il formato dell'artefatto o il modo in cui viene compilata la grammatica
+ARTIFACT_VERSION = 2
+
+TABLE_FILE = 'table.json'
+TERMINALS_FILE = 'terminals.json'
+TOKEN_IDS_FILE = 'token_ids.npy'
+
+# tokenizer -> (len(tokenizer), hash del vocabolario, fingerprint): calcolarli costa quanto serializzare il tokenizer
+_tokenizer_digests = weakref.WeakKeyDictionary()
+
+
+def tokenizer_fingerprint(tokenizer):
+    """
+    Hash of how the tokenizer splits text: the tokenization of the tags depends on the merges, the normalizer
+    and the pre-tokenizer, not only on the vocabulary. For a "fast" tokenizer it is the full definition of the
+    backend tokenizer; otherwise its class and init arguments (e.g. add_prefix_space, do_lower_case).
+    """
+    backend = getattr(tokenizer, 'backend_tokenizer', None)
+    if backend is not None:
+        definition = backend.to_str()
+    else:
+        definition = json.dumps([type(tokenizer).__name__, getattr(tokenizer, 'init_kwargs', {})],
+                                sort_keys=True, default=str)
+    return hashlib.sha256(definition.encode('utf-8')).hexdigest()
+
+
+def _tokenizer_digest(tokenizer):
+    """(hash del vocabolario, fingerprint) del tokenizer, memorizzati per oggetto tokenizer."""
+    size = len(tokenizer)
+    try:
+        cached = _tokenizer_digests.get(tokenizer)
+    except TypeError:
+        # Tokenizer senza weakref: nessuna memorizzazione
+        cached = None
+    # add_tokens() cambia la lunghezza del tokenizer: in quel caso si ricalcola
+    if cached is not None and cached[0] == size:
+        return cached[1:]
+
+    vocab = json.dumps(sorted(tokenizer.get_vocab().items()), ensure_ascii=False)
+    digest = (hashlib.sha256(vocab.encode('utf-8')).hexdigest(), tokenizer_fingerprint(tokenizer))
+    try:
+        _tokenizer_digests[tokenizer] = (size, *digest)
+    except TypeError:
+        pass
+    return digest
+
+
+def grammar_cache_key(tokenizer, productions, regex_dict=None, minimise=False):
+    """
+    Hash of everything the compiled grammar depends on: productions, regex patterns, tokenizer vocabulary
+    and tokenizer definition (see tokenizer_fingerprint). The vocabulary hash and the fingerprint are
+    computed once per tokenizer object.
+    """
+    regexes = {
+        name: [getattr(regex, 'pattern', str(regex)), getattr(regex, 'flags', 0)]
+        for name, regex in (regex_dict or {}).items()
+    }
+    payload = {
+        'version': ARTIFACT_VERSION,
+        'productions': productions,
+        'regex_dict': regexes,
+        'minimise': minimise,
+        'eos_token': tokenizer.eos_token,
+    }
+    payload['vocab'], payload['tokenizer'] = _tokenizer_digest(tokenizer)
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def save_compiled_grammar(path, pars_tab, map_terminal_tokens):
+    """
+    Save the parsing table and the token maps of a compiled grammar in the directory `path`.
+    The token ids of all terminals are stored in a single flat array, so that they can be memory-mapped.
+    """
+    tmp_path = f"{path}.tmp-{uuid.uuid4().hex}"
+    os.makedirs(tmp_path)
+
+    spans = {}
+    chunks = []
+    offset = 0
+    for terminal, tokens in map_terminal_tokens.items():
+        ids = np.asarray(tokens, dtype=np.int64).reshape(-1)
+        spans[terminal] = [offset, offset + ids.size]
+        chunks.append(ids)
+        offset += ids.size
+    token_ids = np.concatenate(chunks) if chunks else np.empty(0, dtype=np.int64)
+    np.save(os.path.join(tmp_path, TOKEN_IDS_FILE), token_ids)
+
+    first_sets = getattr(pars_tab, 'first_sets', {})
+    with open(os.path.join(tmp_path, TABLE_FILE), 'w', encoding='utf-8') as f:
+        json.dump({
+            'table': pars_tab,
+            'first_sets': {nt: sorted(first) for nt, first in first_sets.items()},
+        }, f, ensure_ascii=False)
+    with open(os.path.join(tmp_path, TERMINALS_FILE), 'w', encoding='utf-8') as f:
+        json.dump(spans, f, ensure_ascii=False)
+
+    # Rename atomico: un altro processo potrebbe aver già salvato lo stesso artefatto
+    try:
+        os.rename(tmp_path, path)
+    except OSError:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        if not os.path.isdir(path):
+            raise
+    logging.info(f"Grammatica compilata salvata in {path}")
+
+
+def load_compiled_grammar(path):
+    """
+    Load a grammar saved by save_compiled_grammar(). The token ids are memory-mapped copy-on-write
+    (writes never reach the file): every terminal maps to a view of the flat array, nothing is copied.
+    """
+    with open(os.path.join(path, TABLE_FILE), encoding='utf-8') as f:
+        data = json.load(f)
+    with open(os.path.join(path, TERMINALS_FILE), encoding='utf-8') as f:
+        spans = json.load(f)
+    token_ids = np.load(os.path.join(path, TOKEN_IDS_FILE), mmap_mode='c')
+
+    first_sets = {nt: set(first) for nt, first in data['first_sets'].items()}
+    pars_tab = ParsingTable(data['table'], first_sets=first_sets)
+    map_terminal_tokens = {terminal: token_ids[start:end] for terminal, (start, end) in spans.items()}
+    logging.info(f"Grammatica compilata caricata da {path}")
+    return pars_tab, map_terminal_tokens
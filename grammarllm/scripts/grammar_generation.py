@@ -1,8 +1,23 @@
 import re
 import logging
+from collections import deque
+
+# Numero di tag tokenizzati per ogni chiamata batch al tokenizer, per limitare la memoria di picco
+TOKENIZE_BATCH_SIZE = 8192
+
+class TagTrieNode:
+    """Nodo del trie dei token dei tag di una regola"""
+    __slots__ = ('children', 'count', 'end', 'key')
+
+    def __init__(self):
+        self.children = {}  # token -> TagTrieNode, in ordine di prima occorrenza
+        self.count = 0  # numero di tag che passano per questo nodo
+        self.end = None  # se un tag termina qui: numero di figli già presenti in quel momento
+        self.key = None  # classe di equivalenza del sotto-albero (solo con la minimizzazione)
+
 
 class ProductionRuleProcessor:
-    def __init__(self, tokenizer=None):
+    def __init__(self, tokenizer=None, minimise=False):
         self.nt_counter = 0
         self.sub_nt_counter = {}
         self.tag_to_nt_mapping = {}  # Mappa dai tag originali ai NT creati
@@ -10,6 +25,8 @@ class ProductionRuleProcessor:
         self.tokenizer = tokenizer  # Tokenizer di Hugging Face
         self.non_terminals = set()  # Traccia tutti i non terminali
         self.rule_specific_grammars = {}  # Grammatiche specifiche per ogni regola
+        self.minimise = minimise  # Unisce i sotto-alberi equivalenti dei tag in NT condivisi (DAFSA)
+        self.tag_tokens = {}  # Cache tag -> token, valida per una compilazione
     
     def extract_tags_and_others(self,rhs_list):
         """Restituisce una lista di elementi ordinati con tipo 'tag' o 'other'"""
@@ -44,138 +61,113 @@ class ProductionRuleProcessor:
 
     def tokenize_tag(self, tag):
         """Tokenizza un tag usando il tokenizer di Hugging Face"""
+        tokens = self.tag_tokens.get(tag)
+        if tokens is not None:
+            return tokens
+
         if self.tokenizer is None:
             # Fallback alla tokenizzazione semplice se non c'è tokenizer
             logging.info("ATTENZIONE: Nessun tokenizer fornito, uso tokenizzazione semplice")
-            return [tag]  # Restituisce il tag come singolo token
-        
-        # Usa il tokenizer di Hugging Face
-        tokens = self.tokenizer.tokenize(tag)
+            tokens = [tag]  # Restituisce il tag come singolo token
+        else:
+            # Usa il tokenizer di Hugging Face
+            tokens = self.tokenizer.tokenize(tag)
+        self.tag_tokens[tag] = tokens
         return tokens
 
-
-    def get_prefix_groups_for_rule(self, tags, rule_name):
-        """Raggruppa i tag in base ai prefissi comuni effettivamente condivisi per una regola specifica"""
-        tokenized = {tag: self.tokenize_tag(tag) for tag in tags if tag}
-        
-        # Trova i prefissi comuni tra più parole
-        prefix_counts = {}
-        for tag, tokens in tokenized.items():
-            if tokens:
-                prefix = tokens[0]
-                prefix_counts.setdefault(prefix, []).append((tag, tokens[1:]))
-
-        # Prefissi condivisi da almeno 2 tag
-        prefix_groups = {prefix: items for prefix, items in prefix_counts.items() if len(items) > 1}
-
-        # Tag non inclusi nei gruppi
-        grouped_tags = {tag for group in prefix_groups.values() for tag, _ in group}
-        ungrouped_tags = [tag for tag in tags if tag not in grouped_tags]
-
-        # TO UNCOMMENT ONLY IF YOU WANT TO DEBUG
-        # # Scrivi su file per debug
-        # with open(f'grammarllm/temp/prefix_group_{rule_name}.txt', 'w+') as f:
-        #     f.write(f"=== PREFISSI PER REGOLA {rule_name} ===\n")
-        #     for prefix, tag_suffix_pairs in prefix_groups.items():
-        #         f.write(f"Prefisso condiviso: {prefix}, Tag e Suffix: {tag_suffix_pairs}\n")
-        #     f.write(f"\nTag non raggruppati:\n{ungrouped_tags}\n")
-
-        return prefix_groups, ungrouped_tags
-    
-    def create_initial_grammar_for_rule(self, prefix_groups, ungrouped_tags, rule_name):
+    def tokenize_tags(self, tags):
         """
-        Crea la grammatica iniziale con NT per ogni gruppo di prefisso condiviso
-        e aggiunge anche i tag non raggruppati (che non condividono alcun prefisso).
+        Tokenizza in anticipo tutti i tag non ancora in cache. Con un tokenizer "fast" i tag vengono
+        passati al tokenizer a blocchi (una chiamata Rust per blocco invece di una per tag).
         """
-        grammar = {}
-        start_productions = []
-
-        # Gestione dei gruppi con prefissi condivisi
-        for i, (prefix, tag_suffix_pairs) in enumerate(prefix_groups.items(), 1):
-            if all(len(suffix) == 0 for _, suffix in tag_suffix_pairs):
-                # Tutti i tag sono singoli token: usa solo il prefisso
-                for tag, _ in tag_suffix_pairs:
-                    start_productions.append(prefix)
-                    self.tag_to_nt_mapping[f"{rule_name}::{tag}"] = prefix
-            else:
-                # Crea un NT con prefisso
-                nt = f"{rule_name}_TAG_NT{i}"
-                start_productions.append(f"{prefix} {nt}")
-
-                suffixes = [suffix for _, suffix in tag_suffix_pairs]
-                grammar[(nt, prefix)] = suffixes
-
-                for tag, _ in tag_suffix_pairs:
-                    self.tag_to_nt_mapping[f"{rule_name}::{tag}"] = f"{prefix} {nt}"
-
-        # Gestione dei tag non raggruppati (tokenizzati completamente)
-        for tag in ungrouped_tags:
-            tokens = self.tokenize_tag(tag)
-            production = " ".join(tokens)
-            start_productions.append(production)
-            self.tag_to_nt_mapping[f"{rule_name}::{tag}"] = production
-
-        #grammar[rule_name] = start_productions
-        return grammar
+        missing = [tag for tag in dict.fromkeys(tags) if tag not in self.tag_tokens]
+        if not missing:
+            return
+        if self.tokenizer is None or not getattr(self.tokenizer, 'is_fast', False):
+            for tag in missing:
+                self.tokenize_tag(tag)
+            return
 
+        for start in range(0, len(missing), TOKENIZE_BATCH_SIZE):
+            batch = missing[start:start + TOKENIZE_BATCH_SIZE]
+            encoding = self.tokenizer(batch, add_special_tokens=False)
+            for i, tag in enumerate(batch):
+                self.tag_tokens[tag] = encoding.tokens(i)
+        logging.info(f"Tokenizzati {len(missing)} tag in batch")
+
+
+    def build_tag_trie(self, tokenized_tags):
+        """Inserisce i tag tokenizzati in un trie di token, in una sola passata (O(token totali))"""
+        root = TagTrieNode()
+        for tokens in tokenized_tags:
+            node = root
+            for token in tokens:
+                child = node.children.get(token)
+                if child is None:
+                    child = node.children[token] = TagTrieNode()
+                child.count += 1
+                node = child
+            if node is not root and node.end is None:
+                node.end = len(node.children)
+        return root
+
+    def minimise_tag_trie(self, root):
+        """
+        Assegna a ogni nodo del trie la classe di equivalenza del suo sotto-albero (stessi suffissi di token),
+        visitando i nodi in post-ordine: i nodi con la stessa chiave possono condividere lo stesso NT,
+        come gli stati di un automa aciclico minimo (DAFSA).
+        """
+        registry = {}
+        stack = [(root, False)]
+        while stack:
+            node, visited = stack.pop()
+            if not visited:
+                stack.append((node, True))
+                stack.extend((child, False) for child in node.children.values())
+                continue
+            signature = (node.end is not None, frozenset((token, child.key) for token, child in node.children.items()))
+            node.key = registry.setdefault(signature, len(registry))
+        return len(registry)
 
-    def find_common_prefixes(self, token_lists):
-        """Trova prefissi comuni in una lista di liste di token"""
-        if len(token_lists) <= 1:
-            return {}
-        
-        prefix_groups = {}
-        for tokens in token_lists:
-            if len(tokens) > 0:
-                first_token = tokens[0]
-                if first_token not in prefix_groups:
-                    prefix_groups[first_token] = []
-                prefix_groups[first_token].append(tokens[1:])
-        
-        common_prefixes = {k: v for k, v in prefix_groups.items() if len(v) > 1}
-        logging.info(f"Prefissi comuni trovati: {common_prefixes}")
-        return common_prefixes
-    
     def get_next_sub_nt(self, parent_nt):
         """Genera il prossimo nome di non terminale per un NT padre"""
         if parent_nt not in self.sub_nt_counter:
             self.sub_nt_counter[parent_nt] = 0
         self.sub_nt_counter[parent_nt] += 1
         return f"{parent_nt}_{self.sub_nt_counter[parent_nt]}"
-    
-    def process_grammar_iteration(self, grammar):
-        """Esegue una iterazione di raffinamento sulla grammatica"""
-        new_grammar = grammar.copy()
-        changed = False
-
-        for key, token_lists in list(grammar.items()):
-            if not isinstance(key, tuple):
-                continue  # Salta produzioni come la regola iniziale
-
-            nt, prefix = key
-            if len(token_lists) > 1:
-                common_prefixes = self.find_common_prefixes(token_lists)
-
-                if common_prefixes:
-                    new_token_lists = []
 
-                    for common_prefix, suffixes in common_prefixes.items():
-                        new_nt = self.get_next_sub_nt(nt)
-                        new_token_lists.append([common_prefix, new_nt])
-                        new_grammar[(new_nt, common_prefix)] = suffixes
-                        changed = True
-
-                    for tokens in token_lists:
-                        if len(tokens) > 0 and tokens[0] not in common_prefixes:
-                            new_token_lists.append(tokens)
-                        elif len(tokens) == 0:
-                            new_token_lists.append(tokens)
-
-                    new_grammar[(nt, prefix)] = new_token_lists
-
-        return new_grammar, changed
+    def productions_for_node(self, node, nt, pending, shared_nts=None):
+        """
+        Produzioni del NT associato a un nodo del trie: prima un [token, sub_NT] per ogni figlio condiviso
+        da più tag (accodato in `pending` per essere espanso), poi, nell'ordine di inserimento, le catene
+        di token dei figli non condivisi e [] se un tag termina nel nodo.
+        Con `shared_nts` (classe di equivalenza -> NT) un sotto-albero già espanso riusa il suo NT.
+        """
+        shared = []
+        others = []
+        for position, (token, child) in enumerate(node.children.items()):
+            if position == node.end:
+                others.append([])
+            if child.count > 1:
+                if shared_nts is not None and child.key in shared_nts:
+                    shared.append([token, shared_nts[child.key]])
+                    continue
+                sub_nt = self.get_next_sub_nt(nt)
+                shared.append([token, sub_nt])
+                pending.append((sub_nt, token, child))
+                if shared_nts is not None:
+                    shared_nts[child.key] = sub_nt
+            else:
+                # Un solo tag passa per questo figlio: il resto del tag resta in linea
+                chain = [token]
+                while child.children:
+                    token, child = next(iter(child.children.items()))
+                    chain.append(token)
+                others.append(chain)
+        if node.end == len(node.children):
+            others.append([])
+        return shared + others
 
-    
     def build_tag_grammar_for_rule(self, tags, rule_name):
         """Costruisce la grammatica per i tag di una specifica regola"""
         logging.info(f"=== COSTRUZIONE GRAMMATICA PER I TAG DELLA REGOLA {rule_name} ===")
@@ -189,33 +181,53 @@ class ProductionRuleProcessor:
         logging.info(f"Tag da processare per {rule_name}: {valid_tags}")
         
         logging.info(f"\n=== STEP 1: Tokenizzazione dei tag per {rule_name} ===")
-        for tag in valid_tags:
-            tokens = self.tokenize_tag(tag)
+        self.tokenize_tags(valid_tags)  # già in cache se chiamata da process_full_grammar
+        tokenized = [self.tag_tokens[tag] for tag in valid_tags]
+        for tag, tokens in zip(valid_tags, tokenized):
             logging.info(f"'{tag}' -> {tokens}")
-        
-        logging.info(f"\n=== STEP 2: Raggruppamento per prefisso per {rule_name} ===")
-        #prefix_groups = self.get_prefix_groups_for_rule(valid_tags, rule_name)
-        prefix_groups, ungrouped_tags = self.get_prefix_groups_for_rule(valid_tags, rule_name)
-        for prefix, tag_suffix_pairs in prefix_groups.items():
-            logging.info(f"Prefisso '{prefix}': {[(tag, suffix) for tag, suffix in tag_suffix_pairs]}")
-        
-        logging.info(f"\n=== STEP 3: Creazione grammatica iniziale per {rule_name} ===")
-        grammar = self.create_initial_grammar_for_rule(prefix_groups, ungrouped_tags, rule_name)
-        
-        logging.info(f"\n=== STEP 4: Iterazioni di raffinamento per {rule_name} ===")
-        iteration = 1
-        while True:
-            logging.info(f"\n--- Iterazione {iteration} per {rule_name} ---")
-            new_grammar, changed = self.process_grammar_iteration(grammar)
-            
-            if not changed:
-                logging.info(f"Nessuna modifica per {rule_name}, algoritmo terminato.")
-                break
-            
-            grammar = new_grammar
-            logging.info(f"Grammatica aggiornata per {rule_name}:")
-            iteration += 1
-        
+
+        logging.info(f"\n=== STEP 2: Costruzione del trie dei token per {rule_name} ===")
+        root = self.build_tag_trie(tokenized)
+        shared_nts = None
+        if self.minimise:
+            classes = self.minimise_tag_trie(root)
+            shared_nts = {}
+            logging.info(f"Minimizzazione per {rule_name}: {classes} sotto-alberi distinti")
+
+        logging.info(f"\n=== STEP 3: Creazione dei non terminali dai nodi del trie per {rule_name} ===")
+        grammar = {}
+        pending = deque()
+        # I prefissi condivisi da almeno 2 tag sono numerati nell'ordine di prima occorrenza
+        group_productions = {}  # primo token condiviso -> produzione che sostituisce il tag
+        groups = [(token, child) for token, child in root.children.items() if child.count > 1]
+        for i, (prefix, child) in enumerate(groups, 1):
+            if not child.children:
+                # Tutti i tag sono singoli token: usa solo il prefisso
+                group_productions[prefix] = prefix
+            elif shared_nts is not None and child.key in shared_nts:
+                group_productions[prefix] = f"{prefix} {shared_nts[child.key]}"
+            else:
+                nt = f"{rule_name}_TAG_NT{i}"
+                group_productions[prefix] = f"{prefix} {nt}"
+                pending.append((nt, prefix, child))
+                if shared_nts is not None:
+                    shared_nts[child.key] = nt
+
+        # Prima i tag dei gruppi, poi quelli che non condividono il primo token (tokenizzati completamente)
+        ungrouped = []
+        for tag, tokens in zip(valid_tags, tokenized):
+            if tokens and tokens[0] in group_productions:
+                self.tag_to_nt_mapping[f"{rule_name}::{tag}"] = group_productions[tokens[0]]
+            else:
+                ungrouped.append((tag, tokens))
+        for tag, tokens in ungrouped:
+            self.tag_to_nt_mapping[f"{rule_name}::{tag}"] = " ".join(tokens)
+
+        # Visita in ampiezza: i NT compaiono livello per livello, come nella versione iterativa
+        while pending:
+            nt, prefix, node = pending.popleft()
+            grammar[(nt, prefix)] = self.productions_for_node(node, nt, pending, shared_nts)
+
         # Salva la grammatica specifica per questa regola
         self.rule_specific_grammars[rule_name] = grammar
         return grammar
@@ -327,21 +339,27 @@ class ProductionRuleProcessor:
         
         # Processa ogni regola separatamente
         final_grammar = {}
-        
+
+        # Estrai gli elementi ordinati con tipo ('tag' o 'other') e i tag specifici di ogni regola
+        elements_by_rule = {}
+        tags_by_rule = {}
+        for lhs, rhs_list in grammar_dict.items():
+            ordered_elements_list = self.extract_tags_and_others(rhs_list)
+            elements_by_rule[lhs] = ordered_elements_list
+            tags_by_rule[lhs] = list(dict.fromkeys(
+                value for ordered_elements in ordered_elements_list for kind, value in ordered_elements if kind == "tag"
+            ))
+
+        # Tutti i tag di tutte le regole vengono tokenizzati una volta sola, in batch
+        self.tokenize_tags(tag for rule_tags in tags_by_rule.values() for tag in rule_tags if tag and tag.strip())
+
         for lhs, rhs_list in grammar_dict.items():
             logging.info(f"\n{'='*60}")
             logging.info(f"PROCESSAMENTO SEPARATO DELLA REGOLA: {lhs}")
             logging.info(f"{'='*60}")
             
-            # Estrai gli elementi ordinati con tipo ('tag' o 'other')
-            ordered_elements_list = self.extract_tags_and_others(rhs_list)
-            
-            # Estrai i tag specifici della regola
-            rule_tags = []
-            for ordered_elements in ordered_elements_list:
-                for kind, value in ordered_elements:
-                    if kind == "tag" and value not in rule_tags:
-                        rule_tags.append(value)
+            ordered_elements_list = elements_by_rule[lhs]
+            rule_tags = tags_by_rule[lhs]
             
             logging.info(f"Tag specifici per {lhs}: {rule_tags}")
             
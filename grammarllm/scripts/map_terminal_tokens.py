@@ -1,21 +1,96 @@
-import re
 import itertools
 import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
+import numpy as np
 
-def generate_token_maps(tokenizer, table_parsing, regex_dict=None):
+# Sotto questa dimensione del vocabolario il costo di avvio dei processi supera il guadagno
+PARALLEL_SCAN_MIN_VOCAB = 65536
+
+
+def scan_vocab_shard(vocab_items, regexes):
+    """Single pass over a list of (token_string, token_id): every token is tested against every regex."""
+    matchers = [(name, regex.match) for name, regex in regexes]
+    matches = {name: [] for name, _ in regexes}
+    for token_str, token_id in vocab_items:
+        for name, match in matchers:
+            if match(token_str):
+                matches[name].append(token_id)
+    return matches
+
+
+def scan_vocabulary(vocab, regexes, max_workers=1, mp_context=None):
+    """
+    Map every regex in `regexes` ({name: compiled regex}) to the ids of the vocabulary tokens it matches,
+    walking the vocabulary once; the ids of each regex keep the vocabulary order.
+
+    The scan is serial by default. With `max_workers` > 1 (None: one per CPU) large vocabularies are
+    split into shards scanned by a process pool, created with `mp_context` (a multiprocessing context,
+    e.g. `multiprocessing.get_context("forkserver")`; None: the platform default start method).
+    """
+    regexes = list(regexes.items())
+    vocab_items = list(vocab.items())
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+
+    if max_workers <= 1 or len(vocab_items) < PARALLEL_SCAN_MIN_VOCAB or not regexes:
+        return scan_vocab_shard(vocab_items, regexes)
+
+    shard_size = -(-len(vocab_items) // max_workers)
+    shards = [vocab_items[i:i + shard_size] for i in range(0, len(vocab_items), shard_size)]
+    try:
+        with ProcessPoolExecutor(max_workers=len(shards), mp_context=mp_context) as executor:
+            results = list(executor.map(scan_vocab_shard, shards, [regexes] * len(shards)))
+    except (BrokenProcessPool, OSError) as e:
+        # Es. script senza `if __name__ == "__main__":` con start method spawn: si ripiega sulla scansione seriale
+        logging.warning(f"Scansione parallela del vocabolario non riuscita ({e}), uso la scansione seriale.")
+        return scan_vocab_shard(vocab_items, regexes)
+
+    matches = {name: [] for name, _ in regexes}
+    for shard_matches in results:
+        for name, token_ids in shard_matches.items():
+            matches[name].extend(token_ids)
+    return matches
+
+
+def generate_token_maps(tokenizer, table_parsing, regex_dict=None, max_workers=1, mp_context=None):
     
     def check_tokens_conflicts(table_parsing, map_terminal_tokens):
         conflicts = []
+        # Token ids di ogni terminale come array numpy, convertiti una sola volta
+        token_arrays = {}
+        checked_rows = set()
+
         for lhs, rhs_list in table_parsing.items():
-        
-            for a, b in itertools.combinations(rhs_list.keys(), 2):
+            terminals = list(rhs_list.keys())
+            row_key = frozenset(terminals)
+            if len(terminals) < 2 or row_key in checked_rows:
+                continue
+            checked_rows.add(row_key)
+
+            arrays = []
+            for terminal in terminals:
+                if terminal not in token_arrays:
+                    token_arrays[terminal] = np.unique(np.asarray(map_terminal_tokens[terminal], dtype=np.int64))
+                arrays.append(token_arrays[terminal])
+
+            # Una sola passata vettoriale per riga: un token è in conflitto se compare in più di un terminale
+            counts = np.bincount(np.concatenate(arrays))
+            if counts.size == 0 or counts.max() <= 1:
+                continue
+            shared = counts > 1
+
+            # Solo i terminali che contengono token condivisi vengono confrontati a coppie, per il report
+            involved = [(terminal, ids[shared[ids]]) for terminal, ids in zip(terminals, arrays) if shared[ids].any()]
+            for (a, ids_a), (b, ids_b) in itertools.combinations(involved, 2):
                 #print((f"Controllo conflitti tra '{a}' e '{b}'..."))  # debug
-                intersection = set(map_terminal_tokens[a]) & set(map_terminal_tokens[b])
-                if intersection:
-                    logging.info(f"Conflitto tra '{a}' e '{b}': {intersection}")  # debug
-                    conflicts.append(f"I set di tokens associati ai terminali '{a}' e '{b}' non sono disgiunti. Intersezione: {list(intersection)[:5]}")
-            
+                intersection = np.intersect1d(ids_a, ids_b, assume_unique=True)
+                if intersection.size:
+                    logging.info(f"Conflitto tra '{a}' e '{b}': {intersection.tolist()}")  # debug
+                    conflicts.append(f"I set di tokens associati ai terminali '{a}' e '{b}' non sono disgiunti. Intersezione: {intersection[:5].tolist()}")
+
 
         # Se ci sono conflitti, li stampiamo o solleviamo un'eccezione con tutti i dettagli
         if conflicts:
@@ -29,21 +104,20 @@ def generate_token_maps(tokenizer, table_parsing, regex_dict=None):
     non_terminal_keys = set(table_parsing.keys())
 
     if regex_dict:
-        # Usa direttamente i token_id
-        map_terminal_tokens = {
-            name[6:]: [token_id for token_str, token_id in vocab.items() if regex.match(token_str)]#[:10]
-            for name, regex in regex_dict.items()
-            if name.startswith('regex_')
-        }
+        # Usa direttamente i token_id, con una sola passata sul vocabolario per tutte le regex
+        regexes = {name[6:]: regex for name, regex in regex_dict.items() if name.startswith('regex_')}
+        map_terminal_tokens = scan_vocabulary(vocab, regexes, max_workers=max_workers, mp_context=mp_context)
 
+    # I terminali letterali corrispondono esattamente a un token: basta una lookup nel vocabolario
+    # (token_string -> token_id), senza scandire l'intero vocabolario con una regex per terminale.
     for lhs, rhs_list in table_parsing.items():
         for terminals in rhs_list.values():
             filtered_terminals = [t for t in terminals if t not in non_terminal_keys]
             for terminal in filtered_terminals:
                 if terminal not in map_terminal_tokens:
                     #print(f"terminal {terminal} aggiunto al map token terminals!") #debug
-                    regex = re.compile(rf"^{re.escape(terminal)}$")
-                    map_terminal_tokens[terminal] = [token_id for token_str, token_id in vocab.items() if regex.match(token_str)]
+                    token_id = vocab.get(terminal)
+                    map_terminal_tokens[terminal] = [token_id] if token_id is not None else []
 
     conflicts = check_tokens_conflicts(table_parsing, map_terminal_tokens)
     if conflicts:
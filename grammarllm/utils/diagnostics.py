@@ -0,0 +1,21 @@
+import os
+
+# Diagnostica della decodifica vincolata (stack del parser, terminali ammessi, token forzati), spenta di default:
+# senza di essa il percorso di produzione non costruisce stringhe né calcola softmax/topk per i log.
+# Si attiva con set_debug() o con la variabile d'ambiente GRAMMARLLM_DEBUG=1 prima dell'import.
+DEBUG = os.environ.get("GRAMMARLLM_DEBUG", "") not in ("", "0")
+
+# Con DEBUG attivo, i 10 token più probabili prima e dopo la maschera vengono registrati un passo ogni
+# TRACE_EVERY passi di ogni MaskLogitsProcessor (0: mai), perché softmax e topk sull'intero vocabolario costano.
+TRACE_EVERY = int(os.environ.get("GRAMMARLLM_TRACE_EVERY", "0"))
+
+
+def set_debug(enabled=True, trace_every=None):
+    """
+    Attiva (o disattiva) i log diagnostici della decodifica vincolata.
+    `trace_every`: registra i top-10 token prima/dopo la maschera ogni `trace_every` passi (0: mai).
+    """
+    global DEBUG, TRACE_EVERY
+    DEBUG = enabled
+    if trace_every is not None:
+        TRACE_EVERY = trace_every
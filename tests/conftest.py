@@ -0,0 +1,114 @@
+import os
+import re
+
+import pytest
+import torch
+from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+from transformers import LlamaConfig, LlamaForCausalLM, PreTrainedTokenizerFast
+
+from grammarllm import compile_grammar
+
+# Testo di dominio: le parole delle grammatiche di prova diventano token del vocabolario
+CORPUS = [
+    "positive happy peaceful joyful negative sad angry frustrated neutral calm indifferent unemotional",
+    "Yes I'm very happy ! so really excited today thanks you much great good fine amazing",
+    "<http://example.org/people/MarioRossi> <http://example.org/properties/hasAge> \"40\" "
+    "^^<http://www.w3.org/2001/XMLSchema#integer> . _:b1 @en it en fr sp",
+    "The quick brown fox jumps over the lazy dog 0123456789 abc def (x) [y] {z} http www org example people "
+    "properties XMLSchema decimal string integer",
+]
+
+CLASSIFICATION = {
+    'S*': ["<<positive >> A", "<<negative >> B", "<<neutral >> C"],
+    'A': ["<<happy>>", "<<peaceful>>", "<<joyful>>"],
+    'B': ["<<sad>>", "<<angry>>", "<<frustrated>>"],
+    'C': ["<<calm>>", "<<indifferent>>", "<<unemotional>>"],
+}
+
+VOCABULARY = {
+    'S*': [f"<< {word}>> S*" for word in
+           "Yes I'm very happy ! so really excited today thanks you much great good fine amazing".split()],
+}
+
+RDF = {
+    'S*': ["SUBJ PRED OBJ . S*"],
+    'SUBJ': ["IRI", "BLANKNODE"],
+    'PRED': ["IRI"],
+    'OBJ': ["IRI", "BLANKNODE", "LITERAL"],
+    'IRI': ["< URI >"],
+    'BLANKNODE': ["<<_:>> NAME"],
+    'LITERAL': ["\" STRING \" DESCRIPTION_LANG"],
+    'DESCRIPTION_LANG': ["^^ IRI", "@ LANGTAG", "ε"],
+    'URI': ["<<http://example.org/people/MarioRossi>>", "<<http://example.org/people/LuisaVerdi>>",
+            "<<http://example.org/properties/hasAge>>", "<<http://www.w3.org/2001/XMLSchema#decimal>>",
+            "<<http://www.w3.org/2001/XMLSchema#integer>>", "<<http://www.w3.org/2001/XMLSchema#string>>"],
+    'STRING': ["alfanum STRING", "ε"],
+    'NAME': ["ids NAME_C"],
+    'NAME_C': ["idc NAME_C", "ε"],
+    'LANGTAG': ["<<it >>", "<<en >>", "<<fr >>", "<<sp >>"],
+}
+
+RDF_REGEX = {
+    'regex_alfanum': re.compile(r"[a-zA-Z0-9]+"),
+    'regex_<': re.compile(r"^<$"),
+    'regex_>': re.compile(r"^>$"),
+    'regex_"': re.compile(r'^\"$'),
+    'regex_^^': re.compile(r"^\^\^$"),
+    'regex_@': re.compile(r"^@$"),
+    'regex_.': re.compile(r"^\.$"),
+    'regex_ids': re.compile(r'[A-Za-z_][A-Za-z0-9_-]*'),
+    'regex_idc': re.compile(r'(?![A-Za-z_])[0-9_-][A-Za-z0-9_-]*'),
+}
+
+# nome -> (produzioni, regex_dict)
+GRAMMARS = {
+    'classification': (CLASSIFICATION, None),
+    'vocabulary': (VOCABULARY, None),
+    'rdf': (RDF, RDF_REGEX),
+}
+
+PROMPTS = ["hello world", "Generate RDF triples about people:", "How does the customer feel?"]
+
+
+@pytest.fixture(scope="session", autouse=True)
+def work_dir(tmp_path_factory):
+    """La compilazione scrive la grammatica finale in grammarllm/temp, relativa alla directory corrente."""
+    path = tmp_path_factory.mktemp("work")
+    (path / "grammarllm" / "temp").mkdir(parents=True)
+    previous = os.getcwd()
+    os.chdir(path)
+    yield path
+    os.chdir(previous)
+
+
+def build_tokenizer(corpus, vocab_size):
+    """Byte-level BPE addestrato su `corpus`, con i token speciali <eos> e <pad>."""
+    tokenizer = Tokenizer(models.BPE())
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    trainer = trainers.BpeTrainer(vocab_size=vocab_size, special_tokens=["<eos>", "<pad>"], show_progress=False,
+                                  initial_alphabet=pre_tokenizers.ByteLevel.alphabet())
+    tokenizer.train_from_iterator(corpus, trainer)
+    return PreTrainedTokenizerFast(tokenizer_object=tokenizer, eos_token="<eos>", pad_token="<pad>")
+
+
+@pytest.fixture(scope="session")
+def tokenizer():
+    return build_tokenizer(CORPUS * 20 + [word for line in CORPUS for word in line.split()] * 20, vocab_size=600)
+
+
+@pytest.fixture(scope="session")
+def model(tokenizer):
+    """Llama minuscolo con pesi casuali (seed fisso): le uscite non hanno senso ma sono deterministiche."""
+    torch.manual_seed(0)
+    config = LlamaConfig(vocab_size=len(tokenizer), hidden_size=32, intermediate_size=64, num_hidden_layers=2,
+                         num_attention_heads=2, num_key_value_heads=2, max_position_embeddings=512,
+                         eos_token_id=tokenizer.eos_token_id, pad_token_id=tokenizer.pad_token_id)
+    return LlamaForCausalLM(config).eval()
+
+
+@pytest.fixture(scope="session")
+def grammars(tokenizer):
+    """Le grammatiche di prova compilate una volta: nome -> CompiledGrammar."""
+    return {name: compile_grammar(tokenizer, productions, regex_dict=regex_dict)
+            for name, (productions, regex_dict) in GRAMMARS.items()}
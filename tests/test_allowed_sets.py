@@ -0,0 +1,52 @@
+import random
+
+import pytest
+import torch
+
+from grammarllm.modules.PushdownAutomaton import PushdownAutomaton
+
+
+def legal_terminals(pda, terminals):
+    """Terminali con cui il parser può avanzare, provati uno per uno su copie del PDA (senza cache)."""
+    legal = set()
+    for terminal in terminals:
+        probe = pda.fork()
+        try:
+            probe.next_state_terminal(terminal)
+        except (KeyError, AssertionError):
+            continue
+        legal.add(terminal)
+    return legal
+
+
+def random_walk(pda, grammar, eos_token_id, seed, steps=40):
+    """Segue token ammessi scelti a caso (eos solo se è l'unico) e controlla ogni stato con l'oracolo."""
+    rng = random.Random(seed)
+    terminals = list(grammar.map_terminal_tokens)
+    for _ in range(steps):
+        if pda.eos():
+            break
+        allowed, mask, size = pda.get_terminals_and_mask()
+        expected = legal_terminals(pda, terminals)
+        assert set(allowed) == expected
+        expected_mask = grammar.masks.merge(sorted(expected))
+        assert torch.equal(mask, expected_mask) and size == int(expected_mask.sum())
+
+        ids = [token for token in mask.nonzero().flatten().tolist() if token != eos_token_id]
+        if not ids:
+            break
+        pda.next_state(rng.choice(ids))
+
+
+@pytest.mark.parametrize("name", ['classification', 'vocabulary', 'rdf'])
+@pytest.mark.parametrize("cache_size", [1024, 2])
+def test_cached_allowed_sets_match_the_parser(tokenizer, grammars, name, cache_size):
+    grammar = grammars[name]
+    pda = PushdownAutomaton(grammar=grammar.pars_tab, startSymbol='S*', map=grammar.map_terminal_tokens,
+                            masks=grammar.masks, cache_size=cache_size)
+    for seed in range(5):
+        random_walk(pda.spawn(), grammar, tokenizer.eos_token_id, seed)
+    info = pda.cache_info()
+    assert info.currsize <= cache_size
+    if cache_size > 2:
+        assert info.hits > 0
@@ -0,0 +1,29 @@
+import pytest
+
+from grammarllm import generate_batch_grammar_parameters, generate_text
+
+from .conftest import PROMPTS
+
+
+def generate(model, tokenizer, text, logit_processor, streamer, **options):
+    return generate_text(model, tokenizer, text, logit_processor, streamer, max_new_tokens=24, **options)
+
+
+def single(model, tokenizer, grammar, prompt, **options):
+    return generate(model, tokenizer, prompt, *grammar.session(), **options)
+
+
+@pytest.mark.parametrize("name", ['classification', 'vocabulary', 'rdf'])
+def test_batch_matches_single_prompts(model, tokenizer, grammars, name):
+    expected = [single(model, tokenizer, grammars[name], prompt) for prompt in PROMPTS]
+    assert generate(model, tokenizer, PROMPTS, *grammars[name].session()) == expected
+
+
+@pytest.mark.parametrize("names", [['classification', 'rdf', 'vocabulary'], ['rdf', 'rdf', 'classification']])
+def test_mixed_grammar_batch_matches_single_prompts(model, tokenizer, grammars, names):
+    expected = [single(model, tokenizer, grammars[name], prompt) for name, prompt in zip(names, PROMPTS)]
+    rows = [grammars[name] for name in names]
+    assert generate(model, tokenizer, PROMPTS, *generate_batch_grammar_parameters(tokenizer, rows)) == expected
+    # Le righe possono passare anche come coppie (pars_tab, map_terminal_tokens)
+    pairs = [(grammar.pars_tab, grammar.map_terminal_tokens) for grammar in rows]
+    assert generate(model, tokenizer, PROMPTS, *generate_batch_grammar_parameters(tokenizer, pairs)) == expected
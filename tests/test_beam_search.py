@@ -0,0 +1,49 @@
+import pytest
+
+from grammarllm import generate_batch_grammar_parameters, generate_text
+from grammarllm.modules.BeamLogitProcessor import BeamMaskLogitsProcessor
+
+from .conftest import PROMPTS
+
+
+def replay(grammar, tokens, eos_token_id):
+    """Stato del parser dopo `tokens`, ricostruito da capo: ogni token prima di eos deve essere ammesso."""
+    pda = grammar.new_pda()
+    for token in tokens:
+        if pda.eos():
+            break
+        if token == eos_token_id:
+            pda.finish()
+        else:
+            assert pda.accepts(token)
+            pda.next_state(token)
+    return pda
+
+
+def stack(pda):
+    return None if pda.eos() else tuple(pda.stack)
+
+
+@pytest.mark.parametrize("names", [['rdf'], ['vocabulary'], ['classification'], ['rdf', 'classification', 'vocabulary']])
+def test_forked_beam_states_match_a_replay(model, tokenizer, grammars, names, monkeypatch):
+    rows = [grammars[name] for name in names]
+    checked = []
+    beam_states = BeamMaskLogitsProcessor._beam_states
+
+    def check(self, input_ids):
+        states = beam_states(self, input_ids)
+        prompt_length = self._prompt_length
+        for row, pda in enumerate(states):
+            grammar = rows[row // self.num_beams]
+            generated = input_ids[row, prompt_length:].tolist()
+            assert stack(pda) == stack(replay(grammar, generated, tokenizer.eos_token_id))
+        checked.append(len(states))
+        return states
+    monkeypatch.setattr(BeamMaskLogitsProcessor, "_beam_states", check)
+
+    prompts = PROMPTS[:len(rows)]
+    logit_processor, streamer = generate_batch_grammar_parameters(tokenizer, rows)
+    generate_text(model, tokenizer, prompts if len(rows) > 1 else prompts[0], logit_processor, streamer,
+                  max_new_tokens=16, num_beams=3)
+    assert len(checked) > 1 and all(n == 3 * len(rows) for n in checked)
+
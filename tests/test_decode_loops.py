@@ -0,0 +1,77 @@
+import logging
+
+import pytest
+import torch
+
+from grammarllm import generate_text
+
+from .conftest import PROMPTS
+
+LOOP_OPTIONS = [
+    {'jump_forward': True},
+    {'restricted_head': True},
+    {'pipeline': True},
+    {'jump_forward': True, 'restricted_head': True, 'pipeline': True},
+]
+
+
+def generate(model, tokenizer, grammar, prompt, **options):
+    logit_processor, streamer = grammar.session()
+    return generate_text(model, tokenizer, prompt, logit_processor, streamer, max_new_tokens=24, **options)
+
+
+def forbid_generate(monkeypatch, model):
+    def fail(*args, **kwargs):
+        raise AssertionError("model.generate() non deve essere usato")
+    monkeypatch.setattr(model, "generate", fail)
+
+
+@pytest.mark.parametrize("options", LOOP_OPTIONS)
+def test_sampled_calls_use_the_custom_loop(model, tokenizer, grammars, monkeypatch, caplog, options):
+    forbid_generate(monkeypatch, model)
+    with caplog.at_level(logging.WARNING):
+        answer = generate(model, tokenizer, grammars['rdf'], PROMPTS[1], do_sample=True, temperature=0.7, top_p=0.9,
+                          **options)
+    assert isinstance(answer, str)
+    assert "uso model.generate()" not in caplog.text
+
+
+def test_temperature_in_kwargs_uses_the_custom_loop(model, tokenizer, grammars, monkeypatch):
+    forbid_generate(monkeypatch, model)
+    logit_processor, streamer = grammars['rdf'].session()
+    generate_text(model, tokenizer, PROMPTS[1], logit_processor, streamer, max_new_tokens=8, do_sample=True,
+                  jump_forward=True, temperature=0.7)
+
+
+def test_other_generate_kwargs_fall_back_to_generate(model, tokenizer, grammars, monkeypatch, caplog):
+    calls = []
+    generate_fn = model.generate
+
+    def spy(*args, **kwargs):
+        calls.append(kwargs)
+        return generate_fn(*args, **kwargs)
+    monkeypatch.setattr(model, "generate", spy)
+
+    with caplog.at_level(logging.WARNING):
+        generate(model, tokenizer, grammars['rdf'], PROMPTS[1], jump_forward=True, repetition_penalty=1.3)
+    assert calls and calls[0]['repetition_penalty'] == 1.3
+    assert "repetition_penalty" in caplog.text
+
+
+@pytest.mark.parametrize("name", ['classification', 'vocabulary', 'rdf'])
+@pytest.mark.parametrize("options", LOOP_OPTIONS)
+def test_greedy_loops_match_generate(model, tokenizer, grammars, name, options):
+    for prompt in PROMPTS:
+        expected = generate(model, tokenizer, grammars[name], prompt)
+        assert generate(model, tokenizer, grammars[name], prompt, **options) == expected
+
+
+@pytest.mark.parametrize("name", ['classification', 'vocabulary', 'rdf'])
+def test_pipelined_loop_matches_the_serial_loop_when_sampling(model, tokenizer, grammars, monkeypatch, name):
+    forbid_generate(monkeypatch, model)
+    answers = []
+    for options in ({'jump_forward': True}, {'jump_forward': True, 'pipeline': True}):
+        torch.manual_seed(0)
+        answers.append([generate(model, tokenizer, grammars[name], prompt, do_sample=True, temperature=1.3, **options)
+                        for prompt in PROMPTS])
+    assert answers[0] == answers[1]
@@ -0,0 +1,77 @@
+import random
+
+import pytest
+
+from grammarllm.scripts.generate_LL1_parsing_table import (compute_first_of_string, compute_first_sets,
+                                                           compute_nullable, follow)
+
+from .conftest import RDF
+
+
+def reference_first_follow(productions, start_symbol):
+    """FIRST e FOLLOW da manuale: si ripassano tutte le regole finché nessun insieme cambia."""
+    first = {nt: set() for nt in productions}
+    changed = True
+    while changed:
+        changed = False
+        for lhs, rules in productions.items():
+            for rule in rules:
+                symbols = [symbol for symbol in rule if symbol != 'ε']
+                new = compute_first_of_string(symbols, first) if symbols else {'ε'}
+                if not new <= first[lhs]:
+                    first[lhs] |= new
+                    changed = True
+
+    follow_sets = {nt: set() for nt in productions}
+    follow_sets[start_symbol].add('$')
+    changed = True
+    while changed:
+        changed = False
+        for lhs, rules in productions.items():
+            for rule in rules:
+                symbols = [symbol for symbol in rule if symbol != 'ε']
+                for i, symbol in enumerate(symbols):
+                    if symbol not in productions:
+                        continue
+                    rest = compute_first_of_string(symbols[i + 1:], first)
+                    new = rest - {'ε'}
+                    if 'ε' in rest:
+                        new |= follow_sets[lhs]
+                    if not new <= follow_sets[symbol]:
+                        follow_sets[symbol] |= new
+                        changed = True
+    return first, follow_sets
+
+
+def random_grammar(seed, n_nonterminals=12, n_terminals=6):
+    """Grammatica casuale con regole ε, catene annullabili e ricorsioni (anche sinistre)."""
+    rng = random.Random(seed)
+    nonterminals = ['S*'] + [f"N{i}" for i in range(1, n_nonterminals)]
+    terminals = [f"t{i}" for i in range(n_terminals)]
+    productions = {}
+    for nt in nonterminals:
+        rules = []
+        for _ in range(rng.randint(1, 4)):
+            if rng.random() < 0.15:
+                rules.append(['ε'])
+            else:
+                rules.append([rng.choice(nonterminals if rng.random() < 0.6 else terminals)
+                              for _ in range(rng.randint(1, 4))])
+        productions[nt] = rules
+    return productions
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_worklists_match_the_fixpoint(seed):
+    productions = random_grammar(seed)
+    first, follow_sets = reference_first_follow(productions, 'S*')
+    assert compute_nullable(productions) == {nt for nt, first_set in first.items() if 'ε' in first_set}
+    assert compute_first_sets(productions) == first
+    assert follow(productions, first, 'S*') == follow_sets
+
+
+def test_worklists_match_the_fixpoint_on_rdf():
+    productions = {lhs: [rule.split() for rule in rules] for lhs, rules in RDF.items()}
+    first, follow_sets = reference_first_follow(productions, 'S*')
+    assert compute_first_sets(productions) == first
+    assert follow(productions, first, 'S*') == follow_sets
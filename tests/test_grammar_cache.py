@@ -0,0 +1,73 @@
+import copy
+
+import numpy as np
+import pytest
+from tokenizers import normalizers
+
+from grammarllm import compile_grammar, get_parsing_table_and_map_tt
+from grammarllm.scripts import grammar_cache
+from grammarllm.scripts.grammar_cache import grammar_cache_key, load_compiled_grammar, save_compiled_grammar
+
+from .conftest import CLASSIFICATION, RDF, RDF_REGEX
+
+
+def assert_same_compiled(expected, actual):
+    (expected_table, expected_map), (actual_table, actual_map) = expected, actual
+    assert dict(actual_table) == dict(expected_table)
+    assert actual_table.first_sets == expected_table.first_sets
+    assert actual_table.nullable == expected_table.nullable
+    assert set(actual_map) == set(expected_map)
+    for terminal, tokens in expected_map.items():
+        assert np.array_equal(np.asarray(actual_map[terminal]).reshape(-1), np.asarray(tokens).reshape(-1))
+
+
+@pytest.mark.parametrize("productions, regex_dict", [(CLASSIFICATION, None), (RDF, RDF_REGEX)])
+def test_save_and_load_round_trip(tokenizer, tmp_path, productions, regex_dict):
+    compiled = get_parsing_table_and_map_tt(tokenizer, productions, regex_dict=regex_dict)
+    save_compiled_grammar(str(tmp_path / "artifact"), *compiled)
+    assert_same_compiled(compiled, load_compiled_grammar(str(tmp_path / "artifact")))
+
+
+def test_cache_dir_loads_the_artifact(tokenizer, tmp_path):
+    first = compile_grammar(tokenizer, RDF, regex_dict=RDF_REGEX, cache_dir=str(tmp_path))
+    second = compile_grammar(tokenizer, RDF, regex_dict=RDF_REGEX, cache_dir=str(tmp_path))
+    assert "generate_token_maps" in first.compile_times
+    assert set(second.compile_times) == {"load_compiled_grammar", "token_masks"}
+    assert_same_compiled((first.pars_tab, first.map_terminal_tokens), (second.pars_tab, second.map_terminal_tokens))
+
+
+def test_cache_key_changes_with_every_input(tokenizer):
+    key = grammar_cache_key(tokenizer, RDF, RDF_REGEX)
+    assert grammar_cache_key(tokenizer, RDF, RDF_REGEX) == key
+    other_productions = {**RDF, 'LANGTAG': ["<<it >>", "<<en >>"]}
+    other_regex = {**RDF_REGEX, 'regex_alfanum': RDF_REGEX['regex_alfanum'].pattern + "_"}
+    assert len({key, grammar_cache_key(tokenizer, other_productions, RDF_REGEX),
+                grammar_cache_key(tokenizer, RDF, other_regex),
+                grammar_cache_key(tokenizer, RDF, RDF_REGEX, minimise=True)}) == 4
+
+
+def test_cache_key_changes_with_the_tokenizer(tokenizer):
+    key = grammar_cache_key(tokenizer, CLASSIFICATION)
+
+    lowercase = copy.deepcopy(tokenizer)
+    lowercase.backend_tokenizer.normalizer = normalizers.Lowercase()
+    assert grammar_cache_key(lowercase, CLASSIFICATION) != key
+
+    extended = copy.deepcopy(tokenizer)
+    assert grammar_cache_key(extended, CLASSIFICATION) == key
+    extended.add_tokens(["joyfulness"])
+    assert grammar_cache_key(extended, CLASSIFICATION) != key
+
+
+def test_tokenizer_digest_is_memoised(tokenizer, monkeypatch):
+    tokenizer = copy.deepcopy(tokenizer)
+    calls = []
+    fingerprint = grammar_cache.tokenizer_fingerprint
+    monkeypatch.setattr(grammar_cache, "tokenizer_fingerprint", lambda t: calls.append(t) or fingerprint(t))
+
+    for productions in (CLASSIFICATION, RDF, CLASSIFICATION):
+        grammar_cache_key(tokenizer, productions)
+    assert len(calls) == 1
+    tokenizer.add_tokens(["joyfulness"])
+    grammar_cache_key(tokenizer, CLASSIFICATION)
+    assert len(calls) == 2
@@ -0,0 +1,63 @@
+import itertools
+import os
+import random
+
+from grammarllm import get_parsing_table_and_map_tt
+from grammarllm.scripts.enumerate_sentences import enumerate_sentences
+from grammarllm.scripts.grammar_cache import save_compiled_grammar
+
+from .conftest import build_tokenizer
+
+SYLLABLES = ["ka", "lo", "mi", "ne", "ru", "sa", "to", "vi", "ze", "po", "qua", "bre", "sti", "gno"]
+SUFFIXES = ["integer", "decimal", "string"]
+
+
+def random_names(n, seed):
+    rng = random.Random(seed)
+    names = set()
+    while len(names) < n:
+        names.add("".join(rng.choice(SYLLABLES) for _ in range(3)))
+    return sorted(names)
+
+
+def ontology_iris():
+    """IRI di un'ontologia: classi e proprietà condivise tra i domini, con i suffissi #integer/#decimal/#string."""
+    domains, classes, properties = random_names(12, 1), random_names(6, 2), random_names(4, 3)
+    return [f"http://example.org/{domain}/{cls}/{prop}#{suffix}"
+            for domain, cls, prop, suffix in itertools.product(domains, classes, properties, SUFFIXES)]
+
+
+def unique_prefix_iris(n_iris=300):
+    """IRI con un prefisso diverso per ognuna e uno dei suffissi #integer/#decimal/#string."""
+    return [f"http://www.w3.org/2001/XMLSchema/{name}#{SUFFIXES[i % 3]}"
+            for i, name in enumerate(random_names(n_iris, 0))]
+
+
+def compile_both(iris):
+    tokenizer = build_tokenizer(iris * 5 + SYLLABLES * 20, vocab_size=600)
+    productions = {'S*': [f"<<{iri}>>" for iri in iris]}
+    return (get_parsing_table_and_map_tt(tokenizer, productions),
+            get_parsing_table_and_map_tt(tokenizer, productions, minimise=True))
+
+
+def artifact_bytes(path, pars_tab, map_terminal_tokens):
+    save_compiled_grammar(str(path), pars_tab, map_terminal_tokens)
+    return sum(entry.stat().st_size for entry in os.scandir(path))
+
+
+def assert_same_language(full, minimised):
+    assert sorted(map(tuple, enumerate_sentences(*minimised))) == sorted(map(tuple, enumerate_sentences(*full)))
+
+
+def test_minimise_shrinks_shared_sub_trees(tmp_path):
+    full, minimised = compile_both(ontology_iris())
+    assert len(minimised[0]) * 5 < len(full[0])
+    assert artifact_bytes(tmp_path / "min", *minimised) * 2 < artifact_bytes(tmp_path / "full", *full)
+    assert_same_language(full, minimised)
+
+
+def test_minimise_does_not_grow_single_tag_tails(tmp_path):
+    full, minimised = compile_both(unique_prefix_iris())
+    assert len(minimised[0]) <= len(full[0])
+    assert artifact_bytes(tmp_path / "min", *minimised) <= artifact_bytes(tmp_path / "full", *full)
+    assert_same_language(full, minimised)
@@ -0,0 +1,34 @@
+import pytest
+
+from grammarllm import PrefixCache, chat_template, create_prompt, generate_text
+
+SYSTEM_PROMPT = "Classify the feeling of the customer as positive, negative or neutral."
+EXAMPLES = [{"role": "user", "content": "I'm so happy today!"}, {"role": "assistant", "content": "positive joyful"},
+            {"role": "user", "content": "The delivery was late again."}, {"role": "assistant", "content": "negative angry"}]
+INPUTS = ["It was fine, nothing special.", "Thanks, great job!", "It was fine, nothing special."]
+
+
+def generate(model, tokenizer, grammar, text, **options):
+    logit_processor, streamer = grammar.session()
+    return generate_text(model, tokenizer, text, logit_processor, streamer, chat_template=chat_template,
+                         max_new_tokens=16, **options)
+
+
+@pytest.mark.parametrize("options", [{}, {'jump_forward': True}, {'pipeline': True, 'restricted_head': True}])
+@pytest.mark.parametrize("name", ['classification', 'rdf'])
+def test_prefix_cache_gives_the_same_outputs(model, tokenizer, grammars, name, options):
+    prefix_cache = PrefixCache()
+    for i, prompt_input in enumerate(INPUTS):
+        conversation = create_prompt(prompt_input, SYSTEM_PROMPT, EXAMPLES)
+        expected = generate(model, tokenizer, grammars[name], conversation, **options)
+        assert generate(model, tokenizer, grammars[name], conversation, prefix_cache=prefix_cache, **options) == expected
+        # La prima richiesta calcola e salva il prefisso statico, le successive lo riusano
+        assert prefix_cache.cache_info().hits == i
+
+
+def test_prefix_cache_belongs_to_one_model(model, tokenizer, grammars):
+    prefix_cache = PrefixCache()
+    conversation = create_prompt(INPUTS[0], SYSTEM_PROMPT, EXAMPLES)
+    generate(model, tokenizer, grammars['classification'], conversation, prefix_cache=prefix_cache)
+    with pytest.raises(ValueError):
+        prefix_cache.lookup(object(), [1, 2, 3])
@@ -0,0 +1,60 @@
+import pytest
+import torch
+
+from grammarllm import get_parsing_table_and_map_tt, rank_candidates
+from grammarllm.scripts.enumerate_sentences import enumerate_sentences
+
+PROMPT = "How does the customer feel?"
+
+
+def brute_force(model, tokenizer, pars_tab, map_terminal_tokens):
+    """Distribuzione sui candidati valutando ogni frase completa, senza KV cache condivisa."""
+    prompt = tokenizer(PROMPT, return_tensors="pt")["input_ids"]
+    eos = tokenizer.eos_token_id
+    scores = {}
+    for candidate in enumerate_sentences(pars_tab, map_terminal_tokens):
+        if candidate == [eos]:
+            continue
+        candidate = candidate + [eos]
+        with torch.no_grad():
+            logits = model(torch.cat([prompt, torch.tensor([candidate])], dim=-1)).logits[0].float()
+        logprobs = torch.log_softmax(logits, dim=-1)
+        start = prompt.shape[1] - 1
+        score = sum(logprobs[start + i, token].item() for i, token in enumerate(candidate))
+        scores[tokenizer.decode(candidate, skip_special_tokens=True)] = score
+    probabilities = torch.softmax(torch.tensor(list(scores.values())), dim=-1).tolist()
+    return dict(zip(scores, probabilities))
+
+
+@pytest.mark.parametrize("batch_size", [None, 1, 2, 4, 64])
+def test_rank_candidates_matches_brute_force(model, tokenizer, grammars, batch_size):
+    grammar = grammars['classification']
+    expected = brute_force(model, tokenizer, grammar.pars_tab, grammar.map_terminal_tokens)
+    distribution = rank_candidates(model, tokenizer, PROMPT, grammar.pars_tab, grammar.map_terminal_tokens,
+                                   return_distribution=True, batch_size=batch_size)
+    assert dict(distribution) == pytest.approx(expected, abs=1e-5)
+    assert rank_candidates(model, tokenizer, PROMPT, grammar.pars_tab, grammar.map_terminal_tokens,
+                           batch_size=batch_size) == max(expected, key=expected.get)
+
+
+def test_prompt_is_prefilled_once(model, tokenizer, grammars, monkeypatch):
+    grammar = grammars['classification']
+    lengths = []
+    forward = model.forward
+    monkeypatch.setattr(model, "forward", lambda *args, **kwargs: lengths.append(kwargs["input_ids"].shape)
+                        or forward(*args, **kwargs))
+    rank_candidates(model, tokenizer, PROMPT, grammar.pars_tab, grammar.map_terminal_tokens, batch_size=4)
+    prompt_length = tokenizer(PROMPT, return_tensors="pt")["input_ids"].shape[1]
+    # Una forward per il prompt, poi una per batch con i soli suffissi dei 9 candidati
+    assert lengths[0] == (1, prompt_length)
+    assert [rows for rows, _ in lengths[1:]] == [4, 4, 1]
+    assert all(columns < prompt_length for _, columns in lengths[1:])
+
+
+def test_labels_that_prefix_other_labels_are_candidates(model, tokenizer):
+    pars_tab, map_terminal_tokens = get_parsing_table_and_map_tt(
+        tokenizer, {'S*': ["<<positive>>", "<<positive happy>>", "<<neutral>>", "<<neutral calm>>"]})
+    distribution = dict(rank_candidates(model, tokenizer, PROMPT, pars_tab, map_terminal_tokens,
+                                        return_distribution=True))
+    assert set(distribution) == {"positive", "positive happy", "neutral", "neutral calm"}
+    assert distribution == pytest.approx(brute_force(model, tokenizer, pars_tab, map_terminal_tokens), abs=1e-5)
@@ -0,0 +1,43 @@
+import gc
+
+import torch
+
+from grammarllm import compile_grammar
+from grammarllm.modules.RestrictedHead import RestrictedHead
+
+from .conftest import CLASSIFICATION
+
+
+def walk(head, pda, max_steps=16):
+    """Segue il primo token ammesso a ogni passo; restituisce gli id ammessi visti."""
+    seen = []
+    for _ in range(max_steps):
+        ids = head.allowed_ids(pda)
+        if pda.eos():
+            break
+        _, mask, size = pda.get_terminals_and_mask()
+        expected = mask.nonzero().flatten() if mask is not None and size else None
+        assert (ids is None) if expected is None else torch.equal(ids, expected)
+        seen.append(ids)
+        pda.next_state(int(ids[0]) if ids is not None else int(expected[0]))
+    return seen
+
+
+def test_allowed_ids_follow_the_masks(model, tokenizer, grammars):
+    grammar = grammars['rdf']
+    head = RestrictedHead(model, grammar.masks, tokenizer.eos_token_id)
+    first = walk(head, grammar.new_pda())
+    # Una seconda sessione della stessa grammatica riusa gli stessi tensori
+    second = walk(head, grammar.new_pda())
+    assert all(a is b for a, b in zip(first, second))
+    assert list(head._allowed_ids) == [grammar.pda.dispatch]
+
+
+def test_allowed_ids_are_dropped_with_the_grammar(model, tokenizer):
+    grammar = compile_grammar(tokenizer, CLASSIFICATION)
+    head = RestrictedHead(model, grammar.masks, tokenizer.eos_token_id)
+    walk(head, grammar.new_pda())
+    assert len(head._allowed_ids) == 1
+    del grammar
+    gc.collect()
+    assert len(head._allowed_ids) == 0
@@ -0,0 +1,57 @@
+import copy
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from grammarllm import compile_grammar, generate_text
+
+from .conftest import PROMPTS, RDF, RDF_REGEX
+
+
+def walk(grammar, seed, steps=30):
+    """Insiemi di terminali visti seguendo token ammessi scelti a caso in una nuova sessione."""
+    rng = random.Random(seed)
+    logit_processor, _ = grammar.session()
+    pda = logit_processor.pda
+    seen = []
+    for _ in range(steps):
+        if pda.eos():
+            break
+        terminals, mask, _ = pda.get_terminals_and_mask()
+        seen.append(tuple(terminals))
+        ids = [token for token in mask.nonzero().flatten().tolist() if token != grammar.tokenizer.eos_token_id]
+        if not ids:
+            break
+        pda.next_state(rng.choice(ids))
+    return seen
+
+
+def test_concurrent_sessions_match_sequential_ones(tokenizer):
+    grammar = compile_grammar(tokenizer, RDF, regex_dict=RDF_REGEX)
+    seeds = range(200)
+    expected = [walk(compile_grammar(tokenizer, RDF, regex_dict=RDF_REGEX), seed) for seed in seeds]
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda seed: walk(grammar, seed), seeds))
+    assert results == expected
+    info = grammar.cache_info()
+    assert info.hits + info.misses == sum(map(len, expected))
+
+
+@pytest.mark.parametrize("options", [{}, {'jump_forward': True, 'restricted_head': True}])
+def test_concurrent_requests_match_sequential_ones(model, tokenizer, grammars, options):
+    requests = [(name, prompt) for name in grammars for prompt in PROMPTS] * 2
+    local = threading.local()
+
+    def run(request):
+        # La tokenizzazione modifica lo stato del tokenizer Rust: una copia per thread
+        if not hasattr(local, 'tokenizer'):
+            local.tokenizer = copy.deepcopy(tokenizer)
+        name, prompt = request
+        logit_processor, streamer = grammars[name].session()
+        return generate_text(model, local.tokenizer, prompt, logit_processor, streamer, max_new_tokens=16, **options)
+
+    expected = [run(request) for request in requests]
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        assert list(executor.map(run, requests)) == expected
@@ -0,0 +1,31 @@
+import pytest
+
+from grammarllm import get_parsing_table_and_map_tt
+from grammarllm.scripts.enumerate_sentences import enumerate_sentences
+
+TAGS = ["positive", "positive happy", "positive peaceful", "pos", "negative sad", "negative angry",
+        "neutral", "neutral calm", "indifferent", "http://example.org/people/MarioRossi",
+        "http://example.org/people/LuisaVerdi", "http://example.org/properties/hasAge"]
+
+
+def tag_ids(tokenizer, tag):
+    return tuple(tokenizer.convert_tokens_to_ids(tokenizer.tokenize(tag)))
+
+
+@pytest.mark.parametrize("minimise", [False, True])
+def test_trie_grammar_accepts_exactly_the_tags(tokenizer, minimise):
+    pars_tab, map_terminal_tokens = get_parsing_table_and_map_tt(
+        tokenizer, {'S*': [f"<<{tag}>>" for tag in TAGS]}, minimise=minimise)
+    sentences = {tuple(sentence) for sentence in enumerate_sentences(pars_tab, map_terminal_tokens)}
+    assert sentences == {tag_ids(tokenizer, tag) for tag in TAGS} | {(tokenizer.eos_token_id,)}
+
+
+def test_tags_of_different_rules_stay_apart(tokenizer):
+    productions = {'S*': ["<<positive >> A", "<<negative >> B"], 'A': ["<<happy>>", "<<peaceful>>"],
+                   'B': ["<<happy>>", "<<sad>>"]}
+    pars_tab, map_terminal_tokens = get_parsing_table_and_map_tt(tokenizer, productions)
+    sentences = {tuple(sentence) for sentence in enumerate_sentences(pars_tab, map_terminal_tokens)}
+    expected = {tag_ids(tokenizer, first) + tag_ids(tokenizer, second)
+                for first, seconds in (("positive ", ("happy", "peaceful")), ("negative ", ("happy", "sad")))
+                for second in seconds}
+    assert sentences == expected | {(tokenizer.eos_token_id,)}
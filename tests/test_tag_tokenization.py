@@ -0,0 +1,39 @@
+import pytest
+from transformers import GPT2Tokenizer, PreTrainedTokenizerFast
+
+from grammarllm.scripts import grammar_generation
+from grammarllm.scripts.grammar_generation import ProductionRuleProcessor
+
+from .conftest import CLASSIFICATION, RDF, VOCABULARY
+
+TAGS = ["positive ", "negative sad", " hello", "http://example.org/people/MarioRossi", "@en", "joyful", "x"]
+
+
+def test_batch_tokenization_matches_tokenize(tokenizer, monkeypatch):
+    monkeypatch.setattr(grammar_generation, "TOKENIZE_BATCH_SIZE", 3)
+    processor = ProductionRuleProcessor(tokenizer=tokenizer)
+    processor.tokenize_tags(TAGS + TAGS[:2])
+    assert processor.tag_tokens == {tag: tokenizer.tokenize(tag) for tag in TAGS}
+
+
+def test_slow_tokenizer_falls_back_to_tokenize(tokenizer, tmp_path):
+    tokenizer.backend_tokenizer.model.save(str(tmp_path))  # vocab.json e merges.txt per il tokenizer lento
+    slow = GPT2Tokenizer(str(tmp_path / "vocab.json"), str(tmp_path / "merges.txt"))
+    processor = ProductionRuleProcessor(tokenizer=slow)
+    processor.tokenize_tags(TAGS)
+    assert processor.tag_tokens == {tag: slow.tokenize(tag) for tag in TAGS}
+
+
+def test_every_tag_is_tokenized_once(tokenizer, monkeypatch):
+    batches = []
+    encode = PreTrainedTokenizerFast.__call__
+    monkeypatch.setattr(PreTrainedTokenizerFast, "__call__",
+                        lambda self, text, **kwargs: batches.append(list(text)) or encode(self, text, **kwargs))
+    monkeypatch.setattr(tokenizer, "tokenize", lambda *args, **kwargs: pytest.fail("tokenize() per tag"))
+    for productions in (CLASSIFICATION, VOCABULARY, RDF):
+        batches.clear()
+        processor = ProductionRuleProcessor(tokenizer=tokenizer)
+        processor.process_full_grammar(productions)
+        # Una sola chiamata al tokenizer con tutti i tag distinti di tutte le regole
+        assert len(batches) == 1
+        assert sorted(batches[0]) == sorted(processor.tag_tokens)
@@ -0,0 +1,55 @@
+import multiprocessing
+import random
+import re
+
+import pytest
+
+from grammarllm.scripts import map_terminal_tokens
+from grammarllm.scripts.map_terminal_tokens import generate_token_maps, scan_vocabulary
+
+from .conftest import RDF_REGEX
+
+REGEXES = {name[6:]: regex for name, regex in RDF_REGEX.items()}
+
+
+def naive_scan(vocab, regexes):
+    """Una passata sul vocabolario per ogni regex, come prima della scansione unica."""
+    return {name: [token_id for token, token_id in vocab.items() if regex.match(token)]
+            for name, regex in regexes.items()}
+
+
+def test_single_pass_matches_one_scan_per_regex(tokenizer):
+    vocab = tokenizer.get_vocab()
+    assert scan_vocabulary(vocab, REGEXES) == naive_scan(vocab, REGEXES)
+
+
+@pytest.mark.skipif("fork" not in multiprocessing.get_all_start_methods(), reason="richiede il fork")
+def test_sharded_scan_matches_the_serial_one(monkeypatch):
+    rng = random.Random(0)
+    alphabet = "abcXYZ019_-<>\"@.^ "
+    vocab = {"".join(rng.choice(alphabet) for _ in range(rng.randint(1, 6))): i for i in range(5000)}
+    serial = scan_vocabulary(vocab, REGEXES)
+    monkeypatch.setattr(map_terminal_tokens, "PARALLEL_SCAN_MIN_VOCAB", 1000)
+    sharded = scan_vocabulary(vocab, REGEXES, max_workers=3, mp_context=multiprocessing.get_context("fork"))
+    assert sharded == serial == naive_scan(vocab, REGEXES)
+
+
+def test_literal_terminals_are_looked_up_in_the_vocabulary(tokenizer, grammars):
+    grammar = grammars['rdf']
+    vocab = tokenizer.get_vocab()
+    regex_terminals = naive_scan(vocab, REGEXES)
+    literals = 0
+    for terminal, tokens in grammar.map_terminal_tokens.items():
+        if terminal in regex_terminals:
+            assert sorted(tokens) == sorted(regex_terminals[terminal])
+        else:
+            assert list(tokens) == ([vocab[terminal]] if terminal in vocab else [])
+            literals += 1
+    assert literals > 0
+
+
+def test_overlapping_terminals_raise(tokenizer):
+    table = {'S*': {'word': ['word', 'S*'], 'abc': ['abc', 'S*']}}
+    regex_dict = {'regex_word': re.compile(r"[a-z]+$"), 'regex_abc': re.compile(r"[a-c]+$")}
+    with pytest.raises(ValueError, match="non sono disgiunti"):
+        generate_token_maps(tokenizer, table, regex_dict)